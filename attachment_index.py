@@ -0,0 +1,118 @@
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+
+INDEX_FILE_NAME = ".attachments.sqlite"
+BLOB_FOLDER_NAME = ".blobs"
+
+
+class AttachmentIndex(object):
+    """A SQLite index of the attachments downloaded into `folder`, keyed by FileID.
+
+    Each attachment is recorded with its UpdateDate, the sha256 of its content and, once it has been uploaded, when.
+    Content is stored once under `folder/.blobs/<sha256>` and every attachment path is a hard link to its blob (a copy
+    where links are not supported), so a file attached to several entities, or re-uploaded unchanged, takes space
+    once. Safe to share between threads.
+    """
+
+    def __init__(self, folder, path=None):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, BLOB_FOLDER_NAME)
+        os.makedirs(self.blob_folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or os.path.join(folder, INDEX_FILE_NAME), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                  file_id INTEGER PRIMARY KEY,
+                                  update_date TEXT,
+                                  sha256 TEXT,
+                                  size INTEGER,
+                                  path TEXT,
+                                  downloaded_at REAL,
+                                  uploaded_at REAL)""")
+        if "uploaded_at" not in {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}:
+            self._conn.execute("ALTER TABLE files ADD COLUMN uploaded_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+
+    def is_current(self, file_id, update_date):
+        """Whether `file_id` was downloaded at `update_date` and is still on disk."""
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM files WHERE file_id = ? AND update_date IS ?",
+                                     (file_id, _date(update_date))).fetchone()
+        return row is not None and os.path.exists(os.path.join(self.folder, row[0]))
+
+    def missing(self, files, uploaded=False):
+        """FileIDs among `files`, (file_id, update_date) pairs, that were never downloaded or have changed since.
+
+        With `uploaded`, files downloaded but not uploaded yet are missing too. One anti-join answers for the whole
+        batch; unlike `is_current`, it trusts the index and does not look for the files on disk.
+        """
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (file_id INTEGER, update_date TEXT)")
+            self._conn.execute("DELETE FROM wanted")
+            self._conn.executemany("INSERT INTO wanted VALUES (?, ?)",
+                                   ((file_id, _date(update_date)) for file_id, update_date in files))
+            rows = self._conn.execute(f"""SELECT wanted.file_id FROM wanted
+                                          LEFT JOIN files ON files.file_id = wanted.file_id
+                                                         AND files.update_date IS wanted.update_date
+                                          WHERE files.file_id IS NULL
+                                          {"OR files.uploaded_at IS NULL" if uploaded else ""}""").fetchall()
+            self._conn.execute("DELETE FROM wanted")
+        return [file_id for file_id, in rows]
+
+    def needs_upload(self, file_id, update_date):
+        """Whether `file_id` was downloaded at `update_date` but that download has not been uploaded yet."""
+        with self._lock:
+            row = self._conn.execute("""SELECT 1 FROM files
+                                        WHERE file_id = ? AND update_date IS ? AND uploaded_at IS NULL""",
+                                     (file_id, _date(update_date))).fetchone()
+        return row is not None
+
+    def mark_uploaded(self, file_id):
+        with self._lock:
+            self._conn.execute("UPDATE files SET uploaded_at = ? WHERE file_id = ?", (time.time(), file_id))
+
+    def temp_path(self):
+        """A path in the blob folder to download into, on the same filesystem as the blobs."""
+        return os.path.join(self.blob_folder, f"download-{threading.get_ident()}-{time.monotonic_ns()}")
+
+    def store(self, file_id, update_date, file_name, downloaded_path, sha256, size):
+        """Move a finished download into the blob store, link it at `file_name` and record it.
+
+        Returns True if the content was new, False if an identical blob was already stored.
+        """
+        blob_path = os.path.join(self.blob_folder, sha256)
+        with self._lock:
+            new_content = not os.path.exists(blob_path)
+            if new_content:
+                os.replace(downloaded_path, blob_path)
+            else:
+                os.remove(downloaded_path)
+
+        path = os.path.join(self.folder, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(blob_path, path)
+        except OSError:
+            shutil.copyfile(blob_path, path)
+
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                               (file_id, _date(update_date), sha256, size, file_name, time.time()))
+        if not new_content:
+            logging.debug(f"{file_name} has the same content as an attachment already stored")
+        return new_content
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _date(update_date):
+    return str(update_date) if update_date is not None else None
@@ -0,0 +1,336 @@
+"""Offline benchmark for the export pipeline.
+
+Seeds synthetic tables into a local Postgres and/or MySQL, then times `greatcontrol.postgres_to_csv` and
+`main.mysql_to_csv` across batch and shard sizes against a stand-in S3 (moto in-process, or any S3-compatible
+endpoint such as MinIO via AWS_ENDPOINT_URL). Every case runs in a fresh process so peak RSS is per case. The random
+columns are generated from `--seed`, so the same arguments always seed the same data.
+
+    python benchmark.py --targets postgres --rows 200000 --width 20 --batch-sizes 1000,10000 --shard-sizes 200000
+"""
+import os
+import json
+import time
+import random
+import string
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+BENCH_PG = {
+    'host': os.getenv("BENCH_PG_HOST", "localhost"),
+    'port': os.getenv("BENCH_PG_PORT", "5432"),
+    'user': os.getenv("BENCH_PG_USER", "postgres"),
+    'password': os.getenv("BENCH_PG_PASSWORD", ""),
+    'database': os.getenv("BENCH_PG_DATABASE", "postgres"),
+}
+BENCH_MYSQL = {
+    'host': os.getenv("BENCH_MYSQL_HOST", "localhost"),
+    'port': int(os.getenv("BENCH_MYSQL_PORT", "3306")),
+    'user': os.getenv("BENCH_MYSQL_USER", "root"),
+    'password': os.getenv("BENCH_MYSQL_PASSWORD", ""),
+    'database': os.getenv("BENCH_MYSQL_DATABASE", "export_bench"),
+}
+BENCH_SCHEMA = "bench"
+BENCH_SEED = 0
+
+# Column types cycled through to reach the requested table width: (Postgres, MySQL).
+COLUMN_TYPES = [
+    ("bigint", "BIGINT"),
+    ("text", "VARCHAR(64)"),
+    ("numeric(12,2)", "DECIMAL(12,2)"),
+    ("timestamp", "DATETIME"),
+    ("boolean", "TINYINT(1)"),
+    ("double precision", "DOUBLE"),
+]
+
+
+def _columns(width):
+    return [(f"c{i}",) + COLUMN_TYPES[i % len(COLUMN_TYPES)] for i in range(width)]
+
+
+def _pg_expression(pg_type, i):
+    return {
+        "bigint": f"g * {i + 1}",
+        "text": f"md5((g + {i})::text)",
+        "numeric(12,2)": "(g % 100000) / 3.0",
+        "timestamp": "timestamp '2020-01-01' + g * interval '1 minute'",
+        "boolean": f"g % {i + 2} = 0",
+        "double precision": "random()",
+    }[pg_type]
+
+
+def _mysql_value(mysql_type, n, rng):
+    if mysql_type == "BIGINT":
+        return n
+    elif mysql_type == "VARCHAR(64)":
+        return ''.join(rng.choices(string.ascii_letters, k=32))
+    elif mysql_type == "DECIMAL(12,2)":
+        return Decimal(n % 100000) / 4
+    elif mysql_type == "DATETIME":
+        return datetime(2020, 1, 1) + timedelta(minutes=n)
+    elif mysql_type == "TINYINT(1)":
+        return n % 2
+    return rng.random()
+
+
+def seed_postgres(tables, rows, width, seed=BENCH_SEED):
+    import psycopg2
+
+    conn = psycopg2.connect(**{('dbname' if k == 'database' else k): v for k, v in BENCH_PG.items()})
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    # setseed takes a value in [-1, 1]; the inserts below run in this session, in generate_series order.
+    cursor.execute("SELECT setseed(%s)", ((seed % 2 ** 31) / 2 ** 31,))
+    columns = _columns(width)
+    for t in range(tables):
+        table = f"{BENCH_SCHEMA}.t{t}"
+        definition = ", ".join(f"{name} {pg_type}" for name, pg_type, _ in columns)
+        cursor.execute(f"CREATE TABLE {table} (id bigint PRIMARY KEY, {definition})")
+        values = ", ".join(_pg_expression(pg_type, i) for i, (_, pg_type, _) in enumerate(columns))
+        cursor.execute(f"INSERT INTO {table} SELECT g, {values} FROM generate_series(1, {int(rows)}) g")
+        cursor.execute(f"ANALYZE {table}")
+    conn.close()
+    logging.info(f"Seeded {tables} Postgres tables of {rows} rows x {width} columns")
+
+
+def seed_mysql(tables, rows, width, batch_size=5000, seed=BENCH_SEED):
+    import mysql.connector
+
+    config = dict(BENCH_MYSQL)
+    database = config.pop('database')
+    conn = mysql.connector.connect(**config)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+    cursor.execute(f"CREATE DATABASE {database}")
+    cursor.execute(f"USE {database}")
+    rng = random.Random(seed)
+    columns = _columns(width)
+    for t in range(tables):
+        definition = ", ".join(f"{name} {mysql_type}" for name, _, mysql_type in columns)
+        cursor.execute(f"CREATE TABLE t{t} (id BIGINT PRIMARY KEY, {definition})")
+        insert = f"INSERT INTO t{t} VALUES ({', '.join(['%s'] * (width + 1))})"
+        for start in range(1, rows + 1, batch_size):
+            batch = [(n,) + tuple(_mysql_value(mysql_type, n, rng) for _, _, mysql_type in columns)
+                     for n in range(start, min(start + batch_size, rows + 1))]
+            cursor.executemany(insert, batch)
+            conn.commit()
+    conn.close()
+    logging.info(f"Seeded {tables} MySQL tables of {rows} rows x {width} columns")
+
+
+class _FirstByte(object):
+    """Records when the exporter first opens an output file or object."""
+
+    def __init__(self):
+        self.at = None
+
+    def wrap(self, fn):
+        def wrapper(*args, **kwargs):
+            if self.at is None:
+                self.at = time.perf_counter()
+            return fn(*args, **kwargs)
+        return wrapper
+
+
+def _s3_bytes(s3, bucket, prefix=""):
+    paginator = s3.get_paginator('list_objects_v2')
+    return sum(obj['Size'] for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+               for obj in page.get('Contents', []))
+
+
+def _run_postgres_case(case, s3_mode):
+    import builtins
+    import greatcontrol
+
+    greatcontrol.database = BENCH_PG['database']
+    greatcontrol.user = BENCH_PG['user']
+    greatcontrol.password = BENCH_PG['password']
+    greatcontrol.host = BENCH_PG['host']
+    greatcontrol.port = BENCH_PG['port']
+
+    first_byte = _FirstByte()
+    greatcontrol.open = first_byte.wrap(builtins.open)
+    greatcontrol.S3Sink.open = first_byte.wrap(greatcontrol.S3Sink.open)
+
+    options = {k: v for k, v in case.items() if k not in ('target', 'rows')}
+    started = time.perf_counter()
+    greatcontrol.postgres_to_csv(BENCH_SCHEMA, **options)
+    elapsed = time.perf_counter() - started
+    output_bytes = _s3_bytes(greatcontrol.get_s3_client(), greatcontrol.bucket_name, f"{BENCH_SCHEMA}/")
+    return elapsed, output_bytes, first_byte.at and first_byte.at - started
+
+
+def _run_mysql_case(case, s3_mode):
+    import zipfile
+    import main
+
+    first_byte = _FirstByte()
+    zipfile.ZipFile.open = first_byte.wrap(zipfile.ZipFile.open)
+
+    options = {k: v for k, v in case.items() if k not in ('target', 'rows', 'max_rows_per_shard')}
+    started = time.perf_counter()
+    zip_file_names = main.mysql_to_csv(db_config=BENCH_MYSQL, **options)
+    elapsed = time.perf_counter() - started
+    output_bytes = sum(os.path.getsize(name) for name in zip_file_names)
+    return elapsed, output_bytes, first_byte.at and first_byte.at - started
+
+
+def _run_case(case, s3_mode, results):
+    logging.getLogger().setLevel(logging.WARNING)
+    os.chdir(tempfile.mkdtemp(prefix="export_bench_"))
+    mock = None
+    if s3_mode == "moto":
+        from moto import mock_aws
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        mock = mock_aws()
+        mock.start()
+    try:
+        run = _run_postgres_case if case['target'] == "postgres" else _run_mysql_case
+        elapsed, output_bytes, time_to_first_byte = run(case, s3_mode)
+        results.put(dict(case,
+                         seconds=round(elapsed, 3),
+                         rows_per_sec=round(case['rows'] / elapsed),
+                         mb_per_sec=round(output_bytes / elapsed / 1024 ** 2, 2),
+                         output_mb=round(output_bytes / 1024 ** 2, 2),
+                         peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                         ttfb_sec=round(time_to_first_byte, 3) if time_to_first_byte is not None else None))
+    except Exception as e:
+        results.put(dict(case, error=str(e)))
+    finally:
+        if mock is not None:
+            mock.stop()
+
+
+def run_benchmark(cases, s3_mode="moto"):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        queue = context.Queue()
+        process = context.Process(target=_run_case, args=(case, s3_mode, queue))
+        process.start()
+        process.join()
+        results.append(queue.get() if not queue.empty() else dict(case, error=f"exit code {process.exitcode}"))
+        logging.info(f"{results[-1]}")
+    return results
+
+
+def benchmark_encoder(rows, width, batch_size=10000):
+    """Time `csv.writer` against `CsvEncoder` on synthetic Postgres rows, no database needed."""
+    import io
+    import csv
+    from collections import namedtuple
+    from csv_encoder import CsvEncoder
+
+    oids = {"bigint": 20, "text": 25, "numeric(12,2)": 1700, "timestamp": 1114, "boolean": 16,
+            "double precision": 701}
+    column = namedtuple('Column', 'name type_code')
+    columns = _columns(width)
+    description = [column(name, oids[pg_type]) for name, pg_type, _ in columns]
+    started = datetime(2020, 1, 1)
+    values = {
+        "bigint": lambda n: n,
+        "text": lambda n: f"name {n}" if n % 50 else 'with "quotes", and commas',
+        "numeric(12,2)": lambda n: Decimal(n % 100000) / 4 if n % 7 else None,
+        "timestamp": lambda n: started + timedelta(minutes=n),
+        "boolean": lambda n: n % 2 == 0,
+        "double precision": lambda n: n / 3,
+    }
+    batch = [tuple(values[pg_type](n) for _, pg_type, _ in columns) for n in range(batch_size)]
+    batches = max(1, rows // batch_size)
+
+    def writer():
+        f = io.StringIO(newline='')
+        for _ in range(batches):
+            csv.writer(f).writerows(batch)
+        return f
+
+    def encoder():
+        f = io.StringIO(newline='')
+        csv_encoder = CsvEncoder(description, "postgres")
+        for _ in range(batches):
+            f.write(csv_encoder.encode(batch))
+        return f
+
+    results = []
+    for name, fn in (("csv.writer", writer), ("CsvEncoder", encoder)):
+        started_at = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started_at
+        results.append(dict(target="encoder", engine=name, batch_size=batch_size, seconds=round(elapsed, 3),
+                            rows_per_sec=round(batches * batch_size / elapsed)))
+    return results
+
+
+def print_report(results):
+    columns = ['target', 'engine', 'workers', 'codec', 'batch_size', 'max_rows_per_shard', 'seconds', 'rows_per_sec',
+               'mb_per_sec', 'output_mb', 'peak_rss_mb', 'ttfb_sec', 'error']
+    columns = [c for c in columns if any(c in r for r in results)]
+    widths = {c: max(len(c), *(len(str(r.get(c, ''))) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r.get(c, '')).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Postgres and MySQL exporters on synthetic data.")
+    parser.add_argument("--targets", default="postgres,mysql")
+    parser.add_argument("--tables", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=100000, help="rows per table")
+    parser.add_argument("--width", type=int, default=10, help="columns per table, besides the id")
+    parser.add_argument("--batch-sizes", default="1000,10000")
+    parser.add_argument("--shard-sizes", default="200000")
+    parser.add_argument("--engines", default="python,copy", help="Postgres export engines")
+    parser.add_argument("--mysql-workers", default="1,4", help="MySQL export worker counts")
+    parser.add_argument("--mysql-codecs", default="deflate", help="MySQL archive codecs, e.g. deflate:1,zstd,lz4,store")
+    parser.add_argument("--s3", choices=["moto", "endpoint"], default="moto",
+                        help="moto runs S3 in-process; endpoint uses AWS_ENDPOINT_URL (e.g. a local MinIO)")
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED, help="seed of the random columns of the seeded data")
+    parser.add_argument("--encoder", action="store_true", help="only compare csv.writer and CsvEncoder, no database")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    targets = args.targets.split(",")
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    shard_sizes = [int(s) for s in args.shard_sizes.split(",")]
+    mysql_workers = [int(w) for w in args.mysql_workers.split(",")]
+    mysql_codecs = args.mysql_codecs.split(",")
+    total_rows = args.tables * args.rows
+
+    if args.encoder:
+        print_report([r for batch_size in batch_sizes for r in benchmark_encoder(args.rows, args.width, batch_size)])
+        return
+
+    cases = []
+    if "postgres" in targets:
+        if not args.skip_seed:
+            seed_postgres(args.tables, args.rows, args.width, seed=args.seed)
+        cases += [dict(target="postgres", rows=total_rows, engine=engine, batch_size=batch_size,
+                       max_rows_per_shard=shard_size)
+                  for engine in args.engines.split(",") for batch_size in batch_sizes for shard_size in shard_sizes]
+    if "mysql" in targets:
+        try:
+            if not args.skip_seed:
+                seed_mysql(args.tables, args.rows, args.width, seed=args.seed)
+            cases += [dict(target="mysql", rows=total_rows, batch_size=batch_size, workers=workers, codec=codec)
+                      for batch_size in batch_sizes for workers in mysql_workers for codec in mysql_codecs]
+        except Exception as e:
+            logging.warning(f"Skipping the MySQL benchmark, could not seed {BENCH_MYSQL['host']}: {e}")
+
+    results = run_benchmark(cases, args.s3)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
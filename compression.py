@@ -0,0 +1,184 @@
+import io
+import os
+import time
+import zlib
+import queue
+import logging
+import threading
+import zipfile
+import metrics
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # lz4 compression is optional
+    lz4 = None
+
+EXPORT_CODEC = os.getenv("EXPORT_CODEC", "deflate")
+COMPRESSION_CHUNK_SIZE = 1024 * 1024
+COMPRESSION_QUEUE_SIZE = 8
+
+# Default level, file extension and zip method of each codec. gzip, zstd and lz4 streams are stored in the archive
+# as is; deflate only exists inside zip entries.
+CODECS = {
+    "store": (None, "", zipfile.ZIP_STORED),
+    "deflate": (6, "", zipfile.ZIP_DEFLATED),
+    "gzip": (6, ".gz", zipfile.ZIP_STORED),
+    "zstd": (3, ".zst", zipfile.ZIP_STORED),
+    "lz4": (0, ".lz4", zipfile.ZIP_STORED),
+}
+
+
+class Codec(object):
+    """A compression codec and level, parsed from specs like "deflate", "deflate:1", "gzip", "zstd:9", "lz4" or "store"."""
+
+    def __init__(self, spec=EXPORT_CODEC):
+        name, _, level = spec.partition(":")
+        if name not in CODECS:
+            raise ValueError(f"Unknown codec: {spec}")
+        if name == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        if name == "lz4" and lz4 is None:
+            raise ValueError("lz4 compression requires the lz4 package")
+        default_level, self.extension, self.zip_method = CODECS[name]
+        self.name = name
+        self.level = int(level) if level else default_level
+
+    def __str__(self):
+        return self.name if self.level is None else f"{self.name}:{self.level}"
+
+    def open_entry(self, zipf, entry_name):
+        """Open `entry_name` for writing in `zipf` with this codec's zip method and level."""
+        # Only one entry of an archive can be open for writing at a time, so setting these is safe.
+        zipf.compression = self.zip_method
+        zipf.compresslevel = self.level if self.name == "deflate" else None
+        return zipf.open(entry_name + self.extension, "w", force_zip64=True)
+
+    def compressor(self):
+        """A stream compressor with zlib's compress/flush interface for codecs that compress outside of zipfile,
+        else None."""
+        if self.name == "gzip":
+            return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif self.name == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        elif self.name == "lz4":
+            return _LZ4Compressor(self.level)
+        return None
+
+
+class _LZ4Compressor(object):
+    """An LZ4 frame compressor that writes the frame header with its first output, like zlib's compressobj."""
+
+    def __init__(self, level):
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        header, self._header = self._header, b""
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        header, self._header = self._header, b""
+        return header + self._compressor.flush()
+
+
+class BackgroundCompressor(io.RawIOBase):
+    """Compresses and writes to `f` on a background thread, so compression overlaps with producing the data.
+
+    Writes are queued (at most `queue_size` chunks) and handed to a worker thread, which runs the codec's compressor,
+    if any, and writes the result to `f`. Deflate happens inside the zip entry's own write, so it is on the worker
+    thread too. `f` is closed by `close()`; errors raised on the worker come back from the next `write()` or `close()`.
+    """
+
+    def __init__(self, f, codec, queue_size=COMPRESSION_QUEUE_SIZE):
+        self.f = f
+        self.codec = codec
+        self.raw_bytes = 0
+        self.seconds = 0.0
+        self._compressor = codec.compressor()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        # Captured here because the worker thread does not see the caller's metric labels.
+        self._labels = metrics.current_labels()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._raise_error()
+        data = bytes(b)
+        self._queue.put(data)
+        self.raw_bytes += len(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        metrics.observe("compress_seconds", self.seconds, codec=self.codec.name, **self._labels)
+        super().close()
+        self.f.close()
+        self._raise_error()
+
+    def _compress(self, data):
+        return self._compressor.compress(data) if self._compressor is not None else data
+
+    def _flush(self):
+        return self._compressor.flush() if self._compressor is not None else b""
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if self._error is not None:
+                if data is None:
+                    return
+                continue  # keep draining so the producer never blocks on a dead worker
+            try:
+                started = time.perf_counter()
+                self.f.write(self._compress(data) if data is not None else self._flush())
+                self.seconds += time.perf_counter() - started
+            except BaseException as e:
+                self._error = e
+            if data is None:
+                return
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+class CompressionReport(object):
+    """Collects the compression ratio and throughput of each exported table."""
+
+    def __init__(self):
+        self.tables = []
+        self._lock = threading.Lock()
+
+    def add(self, table_name, codec, raw_bytes, compressed_bytes, seconds):
+        entry = {
+            'table': table_name,
+            'codec': str(codec),
+            'raw_bytes': raw_bytes,
+            'compressed_bytes': compressed_bytes,
+            'ratio': round(raw_bytes / compressed_bytes, 2) if compressed_bytes else None,
+            'mb_per_sec': round(raw_bytes / seconds / 1024 ** 2, 1) if seconds else None,
+        }
+        with self._lock:
+            self.tables.append(entry)
+        logging.info(f"Compressed {table_name} with {codec}: {raw_bytes} -> {compressed_bytes} bytes "
+                     f"(ratio {entry['ratio']}, {entry['mb_per_sec']} MB/s)")
+        return entry
+
+    def log(self):
+        raw_bytes = sum(t['raw_bytes'] for t in self.tables)
+        compressed_bytes = sum(t['compressed_bytes'] for t in self.tables)
+        if compressed_bytes:
+            logging.info(f"Compressed {len(self.tables)} tables: {raw_bytes} -> {compressed_bytes} bytes "
+                         f"(ratio {raw_bytes / compressed_bytes:.2f})")
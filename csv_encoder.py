@@ -0,0 +1,142 @@
+from datetime import datetime, time
+from itertools import repeat
+
+# How each column is formatted, by psycopg2 type OID.
+POSTGRES_PLAIN_TYPES = {16, 20, 21, 23, 26, 700, 701, 1082, 2950}
+POSTGRES_TIME_TYPES = {1083}
+POSTGRES_TIMESTAMP_TYPES = {1114, 1184}
+POSTGRES_DECIMAL_TYPES = {1700}
+POSTGRES_TEXT_TYPES = {18, 19, 25, 1042, 1043}
+POSTGRES_BINARY_TYPES = {17}
+
+# ... and by mysql.connector field type.
+MYSQL_PLAIN_TYPES = {1, 2, 3, 4, 5, 8, 9, 10, 13, 14, 16}
+MYSQL_TIMESTAMP_TYPES = {7, 12}
+MYSQL_DECIMAL_TYPES = {0, 246}
+MYSQL_STRING_TYPES = {15, 247, 249, 250, 251, 252, 253, 254}
+MYSQL_BINARY_FLAG = 128
+MYSQL_BINARY_CHARSET = 63
+
+_NULL_TO_EMPTY = {'None': ''}
+
+
+def _plain(values):
+    """Values whose str() never needs quoting and has one format: numbers, booleans, dates, uuids."""
+    strings = list(map(str, values))
+    if None in values:
+        # str(None) is the only way to get "None" out of these types.
+        return list(map(_NULL_TO_EMPTY.get, strings, strings))
+    return strings
+
+
+def _timestamp(values):
+    # str() drops the fraction of whole seconds, so one column would mix `00:00:00` and `01:01:01.000005`.
+    if None in values:
+        return ['' if v is None else datetime.isoformat(v, ' ', 'microseconds') for v in values]
+    return list(map(datetime.isoformat, values, repeat(' '), repeat('microseconds')))
+
+
+def _time(values):
+    if None in values:
+        return ['' if v is None else time.isoformat(v, 'microseconds') for v in values]
+    return list(map(time.isoformat, values, repeat('microseconds')))
+
+
+def _decimal(values):
+    # str() switches to scientific notation (`1E+3`) depending on the exponent; one scan of the column finds out.
+    strings = _plain(values)
+    if 'E' in '\x00'.join(strings):
+        return [format(v, 'f') if 'E' in string else string for v, string in zip(values, strings)]
+    return strings
+
+
+def _quote(value):
+    if '"' in value or ',' in value or '\n' in value or '\r' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _other(values):
+    return list(map(_quote, ['' if v is None else v if isinstance(v, str) else str(v) for v in values]))
+
+
+def _text(values):
+    if None in values:
+        values = ['' if v is None else v for v in values]
+    try:
+        joined = '\x00'.join(values)
+    except TypeError:  # not all str after all
+        return _other(values)
+    # One scan of the whole column decides whether any value needs quoting at all.
+    if '"' in joined or ',' in joined or '\n' in joined or '\r' in joined:
+        return list(map(_quote, values))
+    return values
+
+
+def _binary(values):
+    # MySQL flags `_bin`-collated text as binary too, but mysql.connector returns it as str: that is CSV text like any
+    # other. Only real bytes are written as hex.
+    return ['' if v is None else _quote(v) if isinstance(v, str) else '\\x' + bytes(v).hex() for v in values]
+
+
+def _postgres_converter(column):
+    if column.type_code in POSTGRES_PLAIN_TYPES:
+        return _plain
+    elif column.type_code in POSTGRES_TIME_TYPES:
+        return _time
+    elif column.type_code in POSTGRES_TIMESTAMP_TYPES:
+        return _timestamp
+    elif column.type_code in POSTGRES_DECIMAL_TYPES:
+        return _decimal
+    elif column.type_code in POSTGRES_TEXT_TYPES:
+        return _text
+    elif column.type_code in POSTGRES_BINARY_TYPES:
+        return _binary
+    return _other
+
+
+def _mysql_converter(column):
+    type_code, flags, charset = column[1], column[7], column[8] if len(column) > 8 else None
+    if type_code in MYSQL_PLAIN_TYPES:
+        return _plain
+    elif type_code in MYSQL_TIMESTAMP_TYPES:
+        return _timestamp
+    elif type_code in MYSQL_DECIMAL_TYPES:
+        return _decimal
+    elif type_code in MYSQL_STRING_TYPES:
+        binary = charset == MYSQL_BINARY_CHARSET or flags & MYSQL_BINARY_FLAG
+        return _binary if binary else _text
+    return _other
+
+
+class CsvEncoder(object):
+    """Formats batches of DB-API rows as CSV text, the way `csv.writer` does with the default dialect.
+
+    A converter is picked once per column from `cursor.description` (`dialect` is "postgres" or "mysql") and applied
+    to whole columns of a batch at a time, so numbers and dates go through a single `map(str, ...)` and text columns
+    are only quoted value by value when the batch actually contains something to quote. Timestamps are always written with
+    microseconds and decimals in fixed-point notation, so every value of a column has the same format. Binary
+    values are written as hex with a `\\x` prefix, like Postgres' COPY does for bytea.
+    """
+
+    def __init__(self, description, dialect):
+        column_converter = _postgres_converter if dialect == "postgres" else _mysql_converter
+        self.names = [column[0] for column in description]
+        self.converters = [column_converter(column) for column in description]
+
+    def header(self):
+        return self._lines([[name] for name in _text(tuple(self.names))])
+
+    def encode(self, rows):
+        if not rows:
+            return ''
+        elif not self.converters:
+            return '\r\n' * len(rows)
+        return self._lines([convert(values) for convert, values in zip(self.converters, zip(*rows))])
+
+    def _lines(self, columns):
+        if len(columns) == 1:
+            # csv.writer quotes a row made of a single empty field, so it can be told apart from an empty line.
+            return ''.join('""\r\n' if value == '' else value + '\r\n' for value in columns[0])
+        return '\r\n'.join(map(','.join, zip(*columns))) + '\r\n'
+
@@ -1,17 +1,15 @@
 import os
-import urllib.request
-from urllib.error import HTTPError
+import time
+import hashlib
+import logging
+import threading
 import mysql.connector
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from rm_api import stream_to_file, DOWNLOAD_CHUNK_SIZE, HTTP_POOL_SIZE
+from attachment_index import AttachmentIndex
+from mysql_tables import DB_CONFIG
 
 
-DB_CONFIG = {
-    'host': os.getenv("RM_DB_HOST"),
-    'user': os.getenv("RM_DB_USER"),
-    'database': os.getenv("RM_DB_DATABASE"),
-    'password': os.getenv("RM_DB_PASSWORD"),
-}
-
 API_CONFIG = {
     'url': os.getenv("RM_API_URL"),
     'username': os.getenv("RM_API_USERNAME"),
@@ -19,6 +17,8 @@ API_CONFIG = {
     'location_id': os.getenv("RM_API_LOCATION_ID"),
 }
 
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+
 ENTITY_TYPES = {
     'Property': 3,
     'Unit': 4,
@@ -48,20 +48,177 @@ def query_database_for_ids(table_name):
     return records
 
 
-def fetch_file(url, file_name, folder):
-    os.makedirs(folder, exist_ok=True)
-    try:
-        with urllib.request.urlopen(url) as source_file, open(os.path.join(folder, file_name), 'wb') as f:
-            f.write(source_file.read())
-    except HTTPError as e:
-        if e.code != 404:
-            raise e
+def fetch_file(url, file_name, folder, file_id=None, update_date=None):
+    """Download a single file into `folder` and return its size, or None if it was unchanged or not found (404).
+
+    A one-shot: it opens `folder`'s AttachmentIndex and closes it again, so use a Downloader for more than a few
+    files. Any other failed download raises.
+    """
+    with Downloader(folder, workers=1, index=AttachmentIndex(folder)) as downloader:
+        return downloader.download(url, file_name, file_id, update_date, raise_errors=True)
+
+
+class DownloadStats(object):
+    """Thread-safe per-file and aggregate download throughput."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.missing = 0
+        self.failed = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, file_name, size, seconds):
+        with self._lock:
+            if size is None:
+                self.missing += 1
+            else:
+                self.files += 1
+                self.bytes += size
+        if size is None:
+            logging.warning(f"{file_name} not found")
+        else:
+            logging.info(f"Downloaded {file_name}: {size} bytes in {seconds:.2f}s "
+                         f"({size / max(seconds, 1e-6) / 1024 ** 2:.2f} MB/s)")
+
+    def skip(self, file_name):
+        with self._lock:
+            self.skipped += 1
+        logging.debug(f"{file_name} is unchanged since it was downloaded, skipping")
+
+    def duplicate(self):
+        with self._lock:
+            self.duplicates += 1
+
+    def fail(self, file_name, error):
+        with self._lock:
+            self.failed += 1
+        logging.error(f"Download of {file_name} failed. Error: {error}")
+
+    def log(self):
+        elapsed = time.perf_counter() - self.started
+        logging.info(f"Downloaded {self.files} files, {self.bytes} bytes in {elapsed:.1f}s "
+                     f"({self.bytes / max(elapsed, 1e-6) / 1024 ** 2:.2f} MB/s, {self.files / max(elapsed, 1e-6):.1f} "
+                     f"files/s); {self.skipped} unchanged, {self.duplicates} duplicate content, {self.missing} not "
+                     f"found, {self.failed} failed")
+
+
+class Downloader(object):
+    """Downloads files into `folder` on `workers` threads over rm_api's pooled keep-alive connections.
+
+    Every file is streamed to disk in `chunk_size` chunks, so memory does not depend on file size. `submit` blocks
+    once `2 * workers` downloads are pending, so queueing hundreds of thousands of files stays cheap. Use it as a
+    context manager; leaving it waits for the remaining downloads, logs the aggregate throughput and closes the index.
+
+    With an `index` (an AttachmentIndex of `folder`), files submitted with a FileID are skipped when the index has
+    them at the same UpdateDate, and identical content is stored once. A FileID already being downloaded is not
+    downloaded twice: later requests for it wait for the first one and are then skipped if it succeeded.
+    """
+
+    def __init__(self, folder, workers=DOWNLOAD_WORKERS, chunk_size=DOWNLOAD_CHUNK_SIZE, index=None):
+        if workers > HTTP_POOL_SIZE:
+            logging.warning(f"{workers} download workers share {HTTP_POOL_SIZE} pooled connections per host, "
+                            f"raise HTTP_POOL_SIZE to keep them all alive")
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.index = index
+        self.stats = DownloadStats()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(2 * workers)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url, file_name, file_id=None, update_date=None):
+        if self._is_current(file_name, file_id, update_date):
+            return None
+        self._slots.acquire()
+        future = self._executor.submit(self._fetch, url, file_name, file_id, update_date)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def download(self, url, file_name, file_id=None, update_date=None, raise_errors=False):
+        """Download a file on the calling thread. Returns its size, or None if it was skipped, missing or failed.
+
+        Failures are counted in `stats` and logged; with `raise_errors` they are raised too.
+        """
+        return self._fetch(url, file_name, file_id, update_date, raise_errors)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.stats.log()
+        if self.index is not None:
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _is_current(self, file_name, file_id, update_date):
+        if self.index is not None and file_id is not None and self.index.is_current(file_id, update_date):
+            self.stats.skip(file_name)
+            return True
+        return False
+
+    def _fetch(self, url, file_name, file_id, update_date, raise_errors=False):
+        if self.index is None or file_id is None:
+            return self._download(url, file_name, raise_errors=raise_errors)
+        while True:
+            with self._lock:
+                in_flight = self._in_flight.get(file_id)
+                if in_flight is None:
+                    self._in_flight[file_id] = done = threading.Event()
+                    break
+            in_flight.wait()
+        try:
+            if self._is_current(file_name, file_id, update_date):
+                return None
+            return self._download(url, file_name, file_id, update_date, raise_errors)
+        finally:
+            with self._lock:
+                del self._in_flight[file_id]
+            done.set()
+
+    def _download(self, url, file_name, file_id=None, update_date=None, raise_errors=False):
+        started = time.perf_counter()
+        try:
+            if self.index is not None and file_id is not None:
+                size = self._download_indexed(url, file_name, file_id, update_date)
+            else:
+                path = os.path.join(self.folder, file_name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                size = stream_to_file(url, path, self.chunk_size)
+        except Exception as e:
+            self.stats.fail(file_name, e)
+            if raise_errors:
+                raise
+            return None
+        self.stats.add(file_name, size, time.perf_counter() - started)
+        return size
+
+    def _download_indexed(self, url, file_name, file_id, update_date):
+        digest = hashlib.sha256()
+        temp_path = self.index.temp_path()
+        size = stream_to_file(url, temp_path, self.chunk_size, digest)
+        if size is not None and not self.index.store(file_id, update_date, file_name, temp_path, digest.hexdigest(),
+                                                     size):
+            self.stats.duplicate()
+        return size
+
+
+def attachment_file_name(metadata):
+    return f"{metadata['FileID']}/{metadata['Name']}{metadata['Extension']}"
 
 
-def download_files(entity_key, download_url, metadata, folder):
-    os.makedirs(folder, exist_ok=True)
-    file_name = f"{metadata['FileID']}/{metadata['Name']}{metadata['Extension']}"
-    fetch_file(download_url, file_name, folder)
+def download_files(entity_key, download_url, metadata, folder, downloader=None):
+    file_name = attachment_file_name(metadata)
+    if downloader is not None:
+        return downloader.submit(download_url, file_name, metadata['FileID'], metadata.get('UpdateDate'))
+    fetch_file(download_url, file_name, folder, metadata['FileID'], metadata.get('UpdateDate'))
 
 
 def main():
@@ -89,14 +246,15 @@ def main():
         }
     ]
 
-    for record in api_response:
-        entity_key = record.get("DepositID")
-        file_attachments = record.get("FileAttachments", [])
-        for attachment in file_attachments:
-            file_info = attachment.get("File", {})
-            download_url = file_info.get("DownloadURL")
-            if download_url:
-                download_files(entity_key, download_url, file_info)
+    with Downloader("rm_files", index=AttachmentIndex("rm_files")) as downloader:
+        for record in api_response:
+            entity_key = record.get("DepositID")
+            file_attachments = record.get("FileAttachments", [])
+            for attachment in file_attachments:
+                file_info = attachment.get("File", {})
+                download_url = file_info.get("DownloadURL")
+                if download_url:
+                    download_files(entity_key, download_url, file_info, downloader.folder, downloader)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,17 @@
 import os
+import json
 import logging
-import mysql.connector
-import mysql
+import argparse
+import threading
+from datetime import datetime
+from mysql.connector import pooling
 from dotenv import load_dotenv
-from rm_api import get_download_url
+from rm_api import get_download_url, log_file
+from downloader import Downloader, attachment_file_name, DOWNLOAD_WORKERS
+from attachment_index import AttachmentIndex
+from greatcontrol import upload_file_to_s3, bucket_name
+from pipeline import Pipeline
+import metrics
 
 load_dotenv()
 
@@ -13,6 +21,16 @@ HOST = os.getenv("RM_DB_HOST")
 USER = os.getenv("RM_DB_USER")
 DATABASE = os.getenv("RM_DB_DATABASE")
 DB_PASSWORD = os.getenv("RM_DB_PASSWORD")
+DB_POOL_SIZE = int(os.getenv("RM_DB_POOL_SIZE", "4"))
+DISCOVERY_BATCH_SIZE = int(os.getenv("DISCOVERY_BATCH_SIZE", "5000"))
+LAST_RUN_PATH = os.getenv("FILES_LAST_RUN_PATH", ".files_last_run")
+ATTACHMENTS_FOLDER = os.getenv("ATTACHMENTS_FOLDER", "rm_files")
+ATTACHMENTS_PREFIX = "rm_files"
+METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "2"))
+UPLOAD_WORKERS = int(os.getenv("ATTACHMENT_UPLOAD_WORKERS", "4"))
+
+_pool = None
+_pool_lock = threading.Lock()
 
 FILE_METADATA_FIELDS = ['FileID', 'Description', 'CreateDate', 'UpdateDate', 'CreateUserID', 'UpdateUserID']
 
@@ -33,44 +51,130 @@ ENTITY_TYPES = {
 }
 
 
+def get_connection():
+    """Check a connection out of the shared Rent Manager pool; closing it returns it to the pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pooling.MySQLConnectionPool(pool_name="rm_files", pool_size=DB_POOL_SIZE, host=HOST, user=USER,
+                                                database=DATABASE, password=DB_PASSWORD)
+    return _pool.get_connection()
+
+
 def query_database_for_ids(table_name):
-    mydb = mysql.connector.connect(
-        host=HOST,
-        user=USER,
-        database=DATABASE,
-        password=DB_PASSWORD
-    )
+    mydb = get_connection()
+    try:
+        cursor = mydb.cursor()
+        cursor.execute("""select EntityKeyID from fileattachments
+            inner join files on fileattachments.FileID = files.FileID
+            where EntityTypeID = %s group by EntityKeyID""", (ENTITY_TYPES[table_name],))
+        records = cursor.fetchall()
+    finally:
+        mydb.close()
+    return records
 
-    cursor = mydb.cursor()
 
-    cursor.execute("""select EntityKeyID from fileattachments 
+def discover_attachment_ids(entity_names=None, since=None, batch_size=DISCOVERY_BATCH_SIZE):
+    """Yield (entity_name, [(EntityKeyID,), ...]) for every entity with attachments, in batches of `batch_size`.
+
+    Each entity type in `entity_names` (default: every ENTITY_TYPES entry) is walked in EntityKeyID order, one keyset
+    query per batch, so no result is held open, and no connection held, while the batch is being processed. `since`
+    maps entity types to a datetime; only their entities with a file updated after it are returned.
+    """
+    since = since or {}
+    for entity_name in entity_names or list(ENTITY_TYPES):
+        last_key_id = None
+        while True:
+            batch = _attachment_id_batch(ENTITY_TYPES[entity_name], last_key_id, since.get(entity_name), batch_size)
+            if batch:
+                yield entity_name, batch
+            if len(batch) < batch_size:
+                break
+            last_key_id = batch[-1][0]
+
+
+def _attachment_id_batch(entity_type, after, since, batch_size):
+    query = f"""select fileattachments.EntityKeyID from fileattachments
         inner join files on fileattachments.FileID = files.FileID
-        where EntityTypeID = """ + str(ENTITY_TYPES[table_name]) + """ LIMIT 1;""")
-    records = cursor.fetchall()
-    mydb.close()
-    return records
+        where fileattachments.EntityTypeID = %s
+        {"and fileattachments.EntityKeyID > %s" if after is not None else ""}
+        {"and files.UpdateDate > %s" if since is not None else ""}
+        group by fileattachments.EntityKeyID
+        order by fileattachments.EntityKeyID
+        limit %s"""
+    params = [entity_type] + [v for v in (after, since) if v is not None] + [batch_size]
+    mydb = get_connection()
+    try:
+        cursor = mydb.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        mydb.close()
 
 
-def process_files(entity_name):
-    dataset = {
-        "payload": query_database_for_ids(entity_name)  # Fetch these from your database
-    }
+def read_last_runs():
+    """When the last completed run of each entity type started, as a {entity_name: datetime} dict."""
+    if not os.path.exists(LAST_RUN_PATH):
+        return {}
+    with open(LAST_RUN_PATH) as f:
+        try:
+            runs = json.load(f)
+        except ValueError:
+            # Written before runs were recorded per entity type: it does not say which types that run covered.
+            logging.warning(f"Ignoring {LAST_RUN_PATH}, it does not record the entity types of the last run")
+            return {}
+    return {entity_name: datetime.fromisoformat(started_at) for entity_name, started_at in runs.items()}
+
+
+def write_last_run(entity_names, started_at):
+    """Record a completed run of `entity_names`, keeping the last runs of the other entity types."""
+    runs = {entity_name: run.isoformat() for entity_name, run in read_last_runs().items()}
+    runs.update((entity_name, started_at.isoformat()) for entity_name in entity_names)
+    tmp_path = f"{LAST_RUN_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(runs, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, LAST_RUN_PATH)
+
 
+def database_now():
+    mydb = get_connection()
+    try:
+        cursor = mydb.cursor()
+        cursor.execute("select now()")
+        now, = cursor.fetchone()
+    finally:
+        mydb.close()
+    return now
+
+
+def file_url_getter(entity_name, on_file=log_file):
     get_file_url = get_download_url(url='/' + entity_name + 's?embeds=FileAttachments',
                                     source_key='EntityKeyID',
                                     entity_key=f'{entity_name}ID',
-                                    paths_to_files=[['FileAttachments', 'File']])
+                                    paths_to_files=[['FileAttachments', 'File']],
+                                    on_file=on_file)
 
     if entity_name == 'Deposit':
         get_file_url = get_download_url(url='/Deposits?embeds=FileAttachments',
                                         source_key='EntityKeyID',
                                         entity_key=f'{entity_name}ID',
-                                        paths_to_files=[['FileAttachments', 'File']])
+                                        paths_to_files=[['FileAttachments', 'File']],
+                                        on_file=on_file)
     elif entity_name == 'Check':
         get_file_url = get_download_url(url='/Checks?embeds=FileAttachments',
                                         source_key='EntityKeyID',
-                                        entity_key='FileAttachments.EntityKeyID',
-                                        paths_to_files=[['FileAttachments', 'File']])
+                                        entity_key='CheckID',
+                                        paths_to_files=[['FileAttachments', 'File']],
+                                        on_file=on_file)
+    return get_file_url
+
+
+def process_files(entity_name, ids=None):
+    dataset = {
+        "payload": ids if ids is not None else query_database_for_ids(entity_name)
+    }
+
+    get_file_url = file_url_getter(entity_name)
 
     try:
         get_file_url(dataset)
@@ -79,11 +183,102 @@ def process_files(entity_name):
         print(f"An error occurred: {e}")
 
 
+def process_all_files(entity_names=None, since_last_run=False, folder=ATTACHMENTS_FOLDER, bucket=bucket_name):
+    """Export the attachments of every entity type, with all stages running at once.
+
+    Batches of entity ids from discovery feed API lookups of their files, whose downloads into `folder`
+    feed uploads to `bucket` (skipped when it is None). The stages are connected by bounded queues, so a slow stage
+    holds back the ones before it and memory stays flat however many attachments there are. Files the
+    AttachmentIndex of `folder` already has at the same UpdateDate are not downloaded again, and are only uploaded if
+    no upload of them has succeeded yet.
+
+    With `since_last_run`, only entities with files updated since the previous successful run of their entity type
+    are processed.
+    """
+    entity_names = entity_names or list(ENTITY_TYPES)
+    started_at = database_now()
+    since = {}
+    if since_last_run:
+        last_runs = read_last_runs()
+        since = {entity_name: last_runs[entity_name] for entity_name in entity_names if entity_name in last_runs}
+        for entity_name, last_run in since.items():
+            logging.info(f"Looking for {entity_name} attachments updated since {last_run}")
+
+    metadata_failures = []
+    upload_failures = []
+    index = AttachmentIndex(folder)
+
+    with Downloader(folder, index=index) as downloader:
+        def fetch_metadata(item, emit):
+            entity_name, ids = item
+            logging.info(f"Processing {len(ids)} {entity_name} entities with attachments")
+            found = []
+
+            def on_file(rm_entity, file_obj, metadata):
+                found.append((file_obj['DownloadURL'], attachment_file_name(file_obj), metadata.get('FileID'),
+                              metadata.get('UpdateDate')))
+
+            try:
+                file_url_getter(entity_name, on_file)({"payload": ids})
+            except Exception as e:
+                metadata_failures.append(entity_name)
+                logging.error(f"Looking up {entity_name} attachments failed. Error: {e}")
+
+            # One index query for the batch instead of one per file; the files found before a failed lookup still go.
+            wanted = set(index.missing(((file_id, update_date) for _, _, file_id, update_date in found),
+                                       uploaded=bucket is not None))
+            logging.info(f"{len(wanted)} of {len(found)} {entity_name} attachments need downloading or uploading")
+            for file in found:
+                if file[2] in wanted:
+                    emit(file)
+
+        def download(item, emit):
+            url, file_name, file_id, update_date = item
+            downloader.download(url, file_name, file_id, update_date)
+            # Files downloaded by an earlier run whose upload failed are uploaded again too.
+            if index.needs_upload(file_id, update_date):
+                emit((file_name, file_id))
+
+        def upload(item, emit):
+            file_name, file_id = item
+            if upload_file_to_s3(os.path.join(folder, file_name), bucket, f"{ATTACHMENTS_PREFIX}/{file_name}"):
+                index.mark_uploaded(file_id)
+            else:
+                upload_failures.append(file_name)
+
+        pipeline = Pipeline(discover_attachment_ids(entity_names, since))
+        pipeline.stage("metadata", fetch_metadata, METADATA_WORKERS)
+        pipeline.stage("download", download, DOWNLOAD_WORKERS)
+        if bucket is not None:
+            pipeline.stage("upload", upload, UPLOAD_WORKERS)
+        pipeline.run()
+
+    if metadata_failures or downloader.stats.failed or upload_failures:
+        logging.warning(f"{len(metadata_failures)} attachment lookups, {downloader.stats.failed} downloads and "
+                        f"{len(upload_failures)} uploads failed, keeping the previous last run so they are retried")
+    else:
+        write_last_run(entity_names, started_at)
+
+
 if __name__ == "__main__":
-    for entity_type in ['Deposit', 'Check', 'History', 'Units',
-                        'SignableDocuments']:
-        process_files(entity_type)
+    parser = argparse.ArgumentParser(description="Download Rent Manager attachments.")
+    parser.add_argument("--since-last-run", action="store_true",
+                        help="only entities with files updated since the last completed run")
+    parser.add_argument("--folder", default=ATTACHMENTS_FOLDER, help="where attachments are downloaded")
+    parser.add_argument("--no-upload", action="store_true", help="only download, do not upload to S3")
+    # History, Units and SignableDocuments attachments used to be listed here too, but their EntityTypeIDs are not
+    # known, so they have to be added to ENTITY_TYPES before they can be exported.
+    parser.add_argument("entities", nargs="*", default=['Deposit', 'Check'],
+                        help=f"entity types to export, out of {', '.join(ENTITY_TYPES)}")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.entities if name not in ENTITY_TYPES]
+    if unknown:
+        parser.error(f"unknown entity types {', '.join(unknown)}; add their EntityTypeID to ENTITY_TYPES first")
+    try:
+        process_all_files(args.entities, args.since_last_run, args.folder, None if args.no_upload else bucket_name)
+    finally:
+        metrics.write_reports()
 
     # for entity_type in ['Deposit', 'Bill', 'Check', 'Inspections', 'InspectionAreaItems', 'History', 'Units',
     #                     'SignableDocuments']:
-
@@ -1,14 +1,29 @@
+import io
 import os
-import csv
+import re
+import sys
+import json
 import logging
 import boto3
 import glob
+import argparse
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from itertools import islice
+from boto3.s3.transfer import TransferConfig
 from tqdm import tqdm
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple
 from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import DictCursor
-from contextlib import contextmanager
+from contextlib import contextmanager, closing
 from dotenv import load_dotenv
+from parquet_writer import ParquetShardWriter
+from csv_encoder import CsvEncoder
+from compression import Codec
+import metrics
 
 load_dotenv()
 
@@ -28,6 +43,25 @@ __MAX_CONNECTIONS = int(os.getenv("MAX_DB_CONNECTIONS", "5"))
 PoolKey = Tuple[str, str, str, str]
 
 __POOLS: Dict[PoolKey, ThreadedConnectionPool] = {}
+__POOLS_LOCK = threading.Lock()
+
+PARALLEL_TABLE_MIN_SIZE = int(os.getenv("PARALLEL_TABLE_MIN_SIZE", str(1024 ** 3)))
+
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", str(8 * 1024 ** 2)))
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(16 * 1024 ** 2)))
+
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD,
+                                 multipart_chunksize=S3_PART_SIZE,
+                                 max_concurrency=S3_UPLOAD_CONCURRENCY)
+
+__S3_CLIENTS = {}
+__S3_KEYS: Dict[Tuple[str, str], set] = {}
+__S3_LOCK = threading.Lock()
+
+WATERMARK_COLUMNS = os.getenv("WATERMARK_COLUMNS", "updated_at,modified_at,last_modified").split(",")
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".")
 
 
 def remove_all_csv_files(folder):
@@ -40,33 +74,90 @@ def remove_all_csv_files(folder):
             logging.error(f"Failed to remove {csv_file}. Error: {e}")
 
 
+def get_s3_client(region=None):
+    """Return the process-wide S3 client for `region`. boto3 clients are thread-safe once built,
+    but building them off the default session is not, so creation is serialized."""
+    with __S3_LOCK:
+        if region not in __S3_CLIENTS:
+            __S3_CLIENTS[region] = boto3.client('s3', region_name=region)
+        return __S3_CLIENTS[region]
+
+
+def load_s3_key_index(bucket, folder):
+    """List every key under `folder` once and keep them in memory for `check_file_exists_in_s3`."""
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    keys = set()
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{folder}/" if folder else ""):
+        keys.update(obj['Key'] for obj in page.get('Contents', []))
+    logging.info(f"Found {len(keys)} objects under {bucket}/{folder}")
+    with __S3_LOCK:
+        __S3_KEYS[(bucket, folder)] = keys
+    return keys
+
+
 def check_file_exists_in_s3(bucket, object_name, folder):
-    s3 = boto3.client('s3')
     full_object_name = f"{folder}/{object_name}" if folder else object_name
     try:
-        s3.head_object(Bucket=bucket, Key=full_object_name)
-        return True
+        with __S3_LOCK:
+            keys = __S3_KEYS.get((bucket, folder))
+        if keys is None:
+            keys = load_s3_key_index(bucket, folder)
+        return full_object_name in keys
     except Exception as e:
         return False
 
 
 def upload_file_to_s3(file_name, bucket, object_name=None):
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
 
     if object_name is None:
         object_name = file_name
 
     try:
-        s3.upload_file(file_name, bucket, object_name)
+        with metrics.timer("s3_upload_seconds"):
+            s3.upload_file(file_name, bucket, object_name, Config=TRANSFER_CONFIG)
+        metrics.inc("s3_uploaded_bytes", os.path.getsize(file_name))
         logging.info(f"Successfully uploaded {file_name} to {bucket}/{object_name}")
+        with __S3_LOCK:
+            for (indexed_bucket, folder), keys in __S3_KEYS.items():
+                if indexed_bucket == bucket and (not folder or object_name.startswith(f"{folder}/")):
+                    keys.add(object_name)
         return True
     except Exception as e:
+        metrics.inc("s3_upload_failures")
         logging.error(f"Failed to upload {file_name} to {bucket}/{object_name}. Error: {e}")
         return False
 
 
+def remove_stale_shards(bucket, folder, table_name, keep):
+    """Delete every shard of `table_name` under `folder`, full (`{table}_shard_N.*`) or incremental
+    (`{table}_delta_{run_id}_shard_N.*`), that is not one of the `keep` keys.
+
+    Called after a table was exported from scratch. Its new shards only replace the ones of the same name, so
+    when the table shrank (or changed output format) the previous export's other shards, and the deltas that
+    were exported on top of it, would otherwise stay next to the new ones.
+    """
+    s3 = get_s3_client()
+    shard_key = re.compile(rf"{re.escape(f'{folder}/{table_name}')}(_delta_\d{{8}}T\d{{6}}Z)?_shard_\d+\.")
+    stale = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f"{folder}/{table_name}_"):
+        stale.extend(obj['Key'] for obj in page.get('Contents', [])
+                     if shard_key.match(obj['Key']) and obj['Key'] not in keep)
+    for start in range(0, len(stale), 1000):
+        response = s3.delete_objects(Bucket=bucket,
+                                     Delete={'Objects': [{'Key': key} for key in stale[start:start + 1000]]})
+        if response.get('Errors'):
+            raise RuntimeError(f"Failed to delete stale shards of {table_name}: {response['Errors']}")
+    if stale:
+        logging.info(f"Removed {len(stale)} stale shards of {table_name} from {bucket}/{folder}")
+        with __S3_LOCK:
+            for keys in __S3_KEYS.values():
+                keys.difference_update(stale)
+    return stale
+
+
 def ensure_bucket_exists(bucket_name, region="us-east-2"):
-    s3 = boto3.client('s3', region_name=region)
+    s3 = get_s3_client(region)
     try:
         s3.head_bucket(Bucket=bucket_name)
         logging.info(f"Bucket {bucket_name} already exists.")
@@ -86,34 +177,700 @@ def ensure_bucket_exists(bucket_name, region="us-east-2"):
             exit(1)
 
 
-def table_to_csv(cursor, schema_name, table_name, batch_size=1000, max_rows_per_shard=200000):
+class ExportManifest(object):
+    """Per-schema incremental export state, kept in S3 at `{schema_name}/_manifest.json`.
+
+    Maps each table to its watermark column and the highest value already exported. Updates are
+    written back immediately so an interrupted run keeps the progress of the tables it finished.
+    """
+
+    def __init__(self, bucket, schema_name):
+        self.s3 = get_s3_client()
+        self.bucket = bucket
+        self.key = f"{schema_name}/_manifest.json"
+        self._lock = threading.Lock()
+        try:
+            body = self.s3.get_object(Bucket=bucket, Key=self.key)['Body'].read()
+            self.tables = json.loads(body)['tables']
+        except self.s3.exceptions.NoSuchKey:
+            self.tables = {}
+
+    def get(self, table_name):
+        with self._lock:
+            return self.tables.get(table_name)
+
+    def update(self, table_name, entry):
+        with self._lock:
+            self.tables[table_name] = entry
+            body = json.dumps({'tables': self.tables}, indent=2, sort_keys=True)
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body.encode('utf-8'))
+
+
+def find_watermark_column(cursor, schema_name, table_name, candidates=None):
+    """Pick the column incremental exports filter on: the first of `candidates` (WATERMARK_COLUMNS by
+    default) the table has as a NOT NULL column, otherwise a single-column integer primary key. Returns None
+    if neither exists."""
+    candidates = candidates or WATERMARK_COLUMNS
+    cursor.execute("""SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = ANY(%s) AND is_nullable = 'NO'""",
+                   (schema_name, table_name, candidates))
+    columns = {row[0] for row in cursor.fetchall()}
+    for column in candidates:
+        if column in columns:
+            return column
+
+    primary_key = primary_key_columns(cursor, schema_name, table_name)
+    if len(primary_key) == 1 and primary_key[0][1] in ("smallint", "integer", "bigint"):
+        return primary_key[0][0]
+    return None
+
+
+def is_nullable_column(cursor, schema_name, table_name, column):
+    cursor.execute("""SELECT is_nullable = 'YES'
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = %s""", (schema_name, table_name, column))
+    row = cursor.fetchone()
+    return row is not None and row[0]
+
+
+def primary_key_columns(cursor, schema_name, table_name):
+    """Return `[(column, type), ...]` for the table's primary key, in key order."""
+    cursor.execute("""SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_index i
+        CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY k.ord""", (f"{schema_name}.{table_name}",))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+class ExportCheckpoint(object):
+    """Durable progress of one schema export, kept at `{CHECKPOINT_DIR}/{schema_name}.checkpoint.json`.
+
+    Records finished tables and, for tables exported in key ranges, every committed shard with its key range,
+    row count and size. The file is rewritten atomically after each change, so it survives the process dying
+    at any point. Unless `resume` is set, an existing checkpoint is discarded. Once every table is exported the
+    checkpoint is removed, so a later `resume` cannot skip tables of a run that already finished.
+    """
+
+    def __init__(self, schema_name, resume=False, path=None):
+        self.path = path or os.path.join(CHECKPOINT_DIR, f"{schema_name}.checkpoint.json")
+        self._lock = threading.Lock()
+        self.state = {'schema': schema_name, 'tables': {}}
+        if resume:
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self.state = json.load(f)
+                logging.info(f"Resuming export of {schema_name} from {self.path}")
+            else:
+                logging.warning(f"No checkpoint at {self.path}, starting a fresh export.")
+        with self._lock:
+            self._save()
+
+    def table(self, table_name):
+        with self._lock:
+            return json.loads(json.dumps(self.state['tables'].get(table_name, {})))
+
+    def start_table(self, table_name, **details):
+        with self._lock:
+            table = self.state['tables'].setdefault(table_name, {'done': False, 'shards': []})
+            table.update(details)
+            self._save()
+
+    def add_shard(self, table_name, shard):
+        with self._lock:
+            self.state['tables'][table_name]['shards'].append(shard)
+            self._save()
+
+    def finish_table(self, table_name):
+        with self._lock:
+            self.state['tables'].setdefault(table_name, {'shards': []})['done'] = True
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def _increment(cursor, schema_name, table_name, manifest, run_id, watermark_columns=None):
+    """Work out what an incremental run exports for a table.
+
+    Returns `(where, file_prefix, manifest_entry)`, all None when the table has no watermark column and is
+    exported in full, or None when nothing changed since the last run. The upper bound is fixed before the
+    export starts so rows arriving meanwhile are picked up by the next run rather than skipped.
+
+    Rows whose watermark is NULL match neither bound and would never be exported, so a table whose watermark
+    column is nullable is exported in full instead.
+    """
+    previous = manifest.get(table_name) or {}
+    column = (watermark_columns or {}).get(table_name) or previous.get('column') or \
+        find_watermark_column(cursor, schema_name, table_name)
+    if column is None:
+        logging.info(f"No watermark column for {table_name}, exporting it in full.")
+        return None, None, None
+    if is_nullable_column(cursor, schema_name, table_name, column):
+        logging.warning(f"Watermark column {table_name}.{column} is nullable, exporting {table_name} in full.")
+        return None, None, None
+
+    cursor.execute(f"SELECT max({column})::text FROM {schema_name}.{table_name}")
+    high = cursor.fetchone()[0]
+    low = previous.get('watermark') if previous.get('column') == column else None
+    if high is None or high == low:
+        logging.info(f"No new rows in {table_name} since {column} = {low}.")
+        return None
+
+    if low is None:
+        where = cursor.mogrify(f"{column} <= %s", (high,)).decode()
+    else:
+        where = cursor.mogrify(f"{column} > %s AND {column} <= %s", (low, high)).decode()
+    entry = {'column': column, 'since': low, 'watermark': high, 'run_id': run_id}
+    return where, f"{table_name}_delta_{run_id}", entry
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """Writable stream that uploads everything written to it as one S3 object, optionally compressed.
+
+    Bytes are compressed as they arrive and cut into `part_size` parts that are uploaded on background
+    threads while the caller keeps writing. At most `max_concurrency` parts are in flight; `write` blocks
+    when all of them are, so memory stays bounded. Objects smaller than one part skip the multipart
+    upload and are sent with a single `put_object`. `close()` completes the upload, `abort()` discards it.
+    """
+
+    def __init__(self, s3, bucket, key, codec=None, part_size=S3_PART_SIZE,
+                 max_concurrency=S3_UPLOAD_CONCURRENCY):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.bytes_written = 0
+        self._compressor = codec.compressor() if codec is not None else None
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._slots = threading.Semaphore(max_concurrency)
+        self._max_concurrency = max_concurrency
+        self._parts = []
+        # Parts are uploaded on executor threads, which do not see the caller's metric labels.
+        self._labels = metrics.current_labels()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self.bytes_written += len(b)
+        self._buffer += self._compressor.compress(b) if self._compressor else b
+        while len(self._buffer) >= self.part_size:
+            self._submit_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._compressor:
+                self._buffer += self._compressor.flush()
+            if self._upload_id is None:
+                with metrics.timer("s3_upload_seconds", **self._labels):
+                    self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+                metrics.inc("s3_uploaded_bytes", len(self._buffer), **self._labels)
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                self._executor.shutdown(wait=True)
+                parts = [{'PartNumber': number, 'ETag': future.result()} for number, future in self._parts]
+                self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                  MultipartUpload={'Parts': parts})
+            logging.info(f"Successfully uploaded {self.bytes_written} bytes to {self.bucket}/{self.key}")
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            super().close()
+
+    def abort(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+        self._buffer = bytearray()
+        super().close()
+
+    def _submit_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency)
+        part_number = len(self._parts) + 1
+        self._slots.acquire()
+        self._parts.append((part_number, self._executor.submit(self._upload_part, part_number, data)))
+
+    def _upload_part(self, part_number, data):
+        try:
+            with metrics.timer("s3_part_upload_seconds", **self._labels):
+                response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                               PartNumber=part_number, Body=data)
+            metrics.inc("s3_uploaded_bytes", len(data), **self._labels)
+            return response['ETag']
+        finally:
+            self._slots.release()
+
+
+class LocalSink(object):
+    """Writes shard files to the current directory."""
+
+    def open(self, file_name):
+        return open(file_name, "wb")
+
+    def rename(self, src, dst):
+        os.rename(src, dst)
+
+    def remove(self, file_name):
+        os.remove(file_name)
+
+
+class _RecordingSink(object):
+    """Passes shard files through to `sink`, remembering their names so they can all be removed again."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.opened = []
+
+    def open(self, file_name):
+        self.opened.append(file_name)
+        return self.sink.open(file_name)
+
+    def remove(self, file_name):
+        self.sink.remove(file_name)
+
+    def remove_all(self):
+        for file_name in self.opened:
+            try:
+                self.sink.remove(file_name)
+            except FileNotFoundError:
+                pass
+
+
+class S3Sink(object):
+    """Streams shard files straight to `s3://{bucket}/{folder}/{file_name}`, never touching local disk.
+
+    `compression` is a `compression.Codec` spec such as "gzip" or "zstd:9"; the codec's extension is appended to
+    the key.
+    """
+
+    def __init__(self, bucket, folder, compression=None):
+        self.codec = Codec(compression or "store")  # fails fast on an unknown or unavailable codec
+        if self.codec.name == "deflate":
+            raise ValueError("deflate only compresses zip entries, use gzip for S3 shards")
+        self.s3 = get_s3_client()
+        self.bucket = bucket
+        self.folder = folder
+
+    def key(self, file_name):
+        return f"{self.folder}/{file_name}{self.codec.extension}"
+
+    def open(self, file_name):
+        return S3MultipartWriter(self.s3, self.bucket, self.key(file_name), self.codec)
+
+    def rename(self, src, dst):
+        self.s3.copy_object(Bucket=self.bucket, Key=self.key(dst),
+                            CopySource={'Bucket': self.bucket, 'Key': self.key(src)})
+        self.remove(src)
+
+    def remove(self, file_name):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.key(file_name))
+
+
+def _close_shard(f):
+    """Close a shard file and return how many (uncompressed) bytes were written to it."""
+    f.flush()
+    size = getattr(f, 'buffer', f).tell()
+    f.close()
+    return size
+
+
+def _abort_shard(f):
+    raw = getattr(f, 'buffer', f)
+    if hasattr(raw, 'abort'):
+        raw.abort()
+    f.close()
+
+
+class CopyShardWriter(object):
+    """File-like target for `copy_expert` that splits COPY CSV output into shard files.
+
+    Postgres sends the header first, then one CSV record per row. Records can contain quoted
+    newlines, so a row ends at a newline seen outside of quotes; every shard gets its own
+    copy of the header.
+    """
+
+    def __init__(self, file_prefix, max_rows_per_shard, pbar=None, sink=None, first_shard=1, on_shard=None):
+        self.file_prefix = file_prefix
+        self.sink = sink or LocalSink()
+        self.first_shard = first_shard
+        self.on_shard = on_shard
+        self.max_rows_per_shard = max_rows_per_shard
+        self.pbar = pbar
+        self.generated_files = []
+        self.header = None
+        self._pending = b''
+        self._in_quotes = False
+        self._f = None
+        self._shard_rows = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.header is None:
+            # The quotes of the pending bytes were already counted, so the scan picks up where it stopped.
+            scanned = len(self._pending)
+            data = self._pending + data
+            end = self._row_end(data, scanned)
+            if end is None:
+                self._pending = data
+                return
+            self.header, data = data[:end], data[end:]
+            self._pending = b''
+        self._write_rows(data)
+
+    def close(self):
+        if self._f is not None:
+            size = _close_shard(self._f)
+            self._f = None
+            if self.on_shard is not None:
+                self.on_shard(self.generated_files[-1], self._shard_rows, size)
+
+    def abort(self):
+        if self._f is not None:
+            _abort_shard(self._f)
+            self._f = None
+
+    def _row_end(self, data, pos):
+        while True:
+            nl = data.find(b'\n', pos)
+            if nl < 0:
+                if data.count(b'"', pos) % 2:
+                    self._in_quotes = not self._in_quotes
+                return None
+            if data.count(b'"', pos, nl) % 2:
+                self._in_quotes = not self._in_quotes
+            pos = nl + 1
+            if not self._in_quotes:
+                return pos
+
+    def _write_rows(self, data):
+        pos = 0
+        while pos < len(data):
+            if self._f is None:
+                shard_num = len(self.generated_files) + self.first_shard
+                csv_file_name = f"{self.file_prefix}_shard_{shard_num}.csv"
+                self.generated_files.append(csv_file_name)
+                logging.info(f"Creating CSV {csv_file_name}")
+                self._f = self.sink.open(csv_file_name)
+                self._f.write(self.header)
+            start = pos
+            rows = 0
+            while self._shard_rows + rows < self.max_rows_per_shard:
+                end = self._row_end(data, pos)
+                if end is None:
+                    pos = len(data)
+                    break
+                pos = end
+                rows += 1
+            self._f.write(data[start:pos])
+            self._shard_rows += rows
+            if self.pbar is not None:
+                self.pbar.update(rows)
+            if self._shard_rows >= self.max_rows_per_shard:
+                self.close()
+                self._shard_rows = 0
+
+
+def table_to_csv(cursor, schema_name, table_name, batch_size=1000, max_rows_per_shard=200000, itersize=10000,
+                 engine="python", sink=None, where=None, file_prefix=None, output_format="csv"):
+    """Export a table into `{file_prefix}_shard_N.csv` files, written through `sink` (local disk by default).
+
+    `file_prefix` defaults to the table name; `where` optionally restricts the exported rows.
+
+    `engine="python"` streams rows through a named server-side cursor and `CsvEncoder`, reading
+    `itersize` rows per round-trip. `engine="copy"` has Postgres render the CSV itself with
+    `COPY ... TO STDOUT`, which is much faster but formats values the way Postgres does; keep the
+    Python engine for types whose text output downstream consumers can't read.
+
+    `output_format="parquet"` (Python engine only) writes typed, column-compressed
+    `{file_prefix}_shard_N.parquet` files instead.
+    """
+    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (f"{schema_name}.{table_name}",))
+    estimated_rows = cursor.fetchone()[0]
+    pbar = tqdm(total=estimated_rows if estimated_rows > 0 and where is None else None,
+                desc=f"Processing {table_name}")
+    query = f"SELECT * FROM {schema_name}.{table_name}"
+    if where is not None:
+        query += f" WHERE {where}"
+
+    try:
+        return _export_query(cursor, query, file_prefix or table_name, batch_size, max_rows_per_shard, itersize, engine,
+                             pbar, sink, output_format=output_format)
+    finally:
+        pbar.close()
+
+
+def table_to_csv_parallel(cursor, schema_name, table_name, workers=4, batch_size=1000, max_rows_per_shard=200000,
+                          itersize=10000, engine="python", sink=None, where=None, file_prefix=None,
+                          output_format="csv"):
+    """Export one table's shards concurrently, each worker scanning its own range of heap blocks.
+
+    `cursor`'s connection coordinates: it opens a REPEATABLE READ transaction and exports its snapshot
+    with `pg_export_snapshot()`, and every worker imports it with `SET TRANSACTION SNAPSHOT`, so all shards
+    see the same data. Workers take their own connections from the pool. The ranges are ctid ranges, which
+    Postgres 14+ scans with a TID range scan, so the table is read once, in about one range per shard. Older
+    servers have no TID range scan and read the whole table for every range, so there they get one range per
+    worker, and the table is read `workers` times.
+    """
+    sink = sink or LocalSink()
+    file_prefix = file_prefix or table_name
+    conn = cursor.connection
+    conn.commit()
+    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    cursor.execute("""SELECT
+            pg_export_snapshot(),
+            reltuples::bigint,
+            pg_relation_size(oid) / current_setting('block_size')::int
+        FROM pg_class
+        WHERE oid = %s::regclass""", (f"{schema_name}.{table_name}",))
+    snapshot, estimated_rows, blocks = cursor.fetchone()
+
+    if conn.server_version >= 140000:
+        num_ranges = max(workers, math.ceil(max(estimated_rows, 0) / max_rows_per_shard))
+    else:
+        num_ranges = workers
+        logging.warning(f"Postgres {conn.server_version} has no TID range scans, each of the {workers} workers "
+                        f"exporting {table_name} reads the whole table")
+    step = max(math.ceil(blocks / num_ranges), 1)
+    ranges = []
+    for start in range(0, max(blocks, 1), step):
+        block_range = f"ctid >= '({start},0)'::tid"
+        if start + step < blocks:
+            block_range += f" AND ctid < '({start + step},0)'::tid"
+        ranges.append(block_range if where is None else f"{block_range} AND ({where})")
+    logging.info(f"Exporting {table_name} in {len(ranges)} block ranges with {workers} workers")
+
+    pbar = tqdm(total=estimated_rows if estimated_rows > 0 and where is None else None,
+                desc=f"Processing {table_name}")
+    export_args = (batch_size, max_rows_per_shard, itersize, engine, pbar)
+    range_sinks = [_RecordingSink(sink) for _ in ranges]
+    range_files = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_export_range_worker, snapshot, schema_name, table_name, file_prefix, range_num,
+                                       range_filter, *export_args, range_sink, output_format=output_format)
+                       for range_num, (range_filter, range_sink) in enumerate(zip(ranges, range_sinks), start=1)]
+            try:
+                for future in futures:
+                    range_files.append(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    except BaseException:
+        # Leaving the executor waited for the running ranges; remove every shard any range wrote, finished or not.
+        for range_sink in range_sinks:
+            range_sink.remove_all()
+        raise
+    finally:
+        pbar.close()
+        # Release the exported snapshot.
+        conn.commit()
+
+    # Renumber the per-range files into the usual contiguous shard names.
     generated_files = []
-    offset = 0
-    total_rows = cursor.execute(f"SELECT COUNT(*) FROM {schema_name}.{table_name}")
-    total_rows = cursor.fetchone()[0]
-    num_shards = total_rows // max_rows_per_shard + (1 if total_rows % max_rows_per_shard != 0 else 0)
-    for shard_num in range(1, num_shards + 1):
-        offset = (shard_num - 1) * max_rows_per_shard
-        shard_pbar = tqdm(total=min(max_rows_per_shard, total_rows - offset), desc=f"Processing {table_name} (shard {shard_num})")
-        
-        csv_file_name = f"{table_name}_shard_{shard_num}.csv"
-        generated_files.append(csv_file_name)
-        logging.info(f"Creating CSV from table {table_name}, shard {shard_num}")
-        
-        with open(csv_file_name, "w") as f:
-            csv_writer = csv.writer(f)
+    for range_file_name in (f for files in range_files for f in files):
+        extension = os.path.splitext(range_file_name)[1]
+        shard_file_name = f"{file_prefix}_shard_{len(generated_files) + 1}{extension}"
+        sink.rename(range_file_name, shard_file_name)
+        generated_files.append(shard_file_name)
+    return generated_files
+
+
+def iter_keyset_shards(cursor, schema_name, table_name, key, batch_size=1000, max_rows_per_shard=200000,
+                       itersize=10000, engine="python", sink=None, where=None, file_prefix=None, after=None,
+                       first_shard=1, output_format="csv"):
+    """Export a table as consecutive ranges of its (single-column) key, `max_rows_per_shard` rows each.
+
+    Each range's upper bound is looked up on the key's index before the range is exported, so shard boundaries
+    depend only on the data. Yields `(file_name, rows, size, after, last_key)` as each shard is written, where
+    the shard holds `after < key <= last_key`; passing a shard's `last_key` as `after` resumes the export right
+    behind it. `last_key` is None for the final shard.
+    """
+    file_prefix = file_prefix or table_name
+    table = f"{schema_name}.{table_name}"
+    pbar = tqdm(desc=f"Processing {table_name}")
+    shard_num = first_shard
+    try:
+        while True:
+            bounds = [where] if where is not None else []
+            if after is not None:
+                bounds.append(cursor.mogrify(f"{key} > %s", (after,)).decode())
+            condition = f" WHERE {' AND '.join(bounds)}" if bounds else ""
+            cursor.execute(f"SELECT {key}::text AS boundary FROM {table}{condition} ORDER BY {key} OFFSET %s LIMIT 1",
+                           (max_rows_per_shard - 1,))
+            row = cursor.fetchone()
+            last_key = row[0] if row else None
+            if last_key is not None:
+                bounds.append(cursor.mogrify(f"{key} <= %s", (last_key,)).decode())
+            condition = f" WHERE {' AND '.join(bounds)}" if bounds else ""
+
+            # The range is already sized, so it must not be split into several shards.
+            shards = []
+            _export_query(cursor, f"SELECT * FROM {table}{condition}", file_prefix, batch_size, sys.maxsize,
+                          itersize, engine, pbar, sink, shard_num, lambda *shard: shards.append(shard), output_format)
+            if not shards:
+                return
+            file_name, rows, size = shards[0]
+            yield file_name, rows, size, after, last_key
+            if last_key is None:
+                return
+            after = last_key
+            shard_num += 1
+    finally:
+        pbar.close()
+
+
+def _export_range_worker(snapshot, schema_name, table_name, file_prefix, range_num, where, *export_args, **kwargs):
+    with metrics.labels(exporter="postgres", table=table_name), \
+            get_cursor(database=database, user=user, password=password, host=host) as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+        query = f"SELECT * FROM {schema_name}.{table_name} WHERE {where}"
+        return _export_query(cursor, query, f"{file_prefix}_range_{range_num}", *export_args, **kwargs)
+
+
+def _export_query(cursor, query, file_prefix, batch_size, max_rows_per_shard, itersize, engine, pbar, sink=None,
+                  first_shard=1, on_shard=None, output_format="csv"):
+    """Write the rows of `query` to `{file_prefix}_shard_N` files, numbered from `first_shard`.
+
+    `on_shard(file_name, rows, size)` is called as each shard is completed.
+    """
+    sink = sink or LocalSink()
+    if output_format not in SHARD_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    shard_args = (pbar, sink, first_shard, on_shard)
+    if engine == "copy":
+        if output_format != "csv":
+            raise ValueError("The copy engine only writes CSV, use engine='python' for other formats")
+        return _copy_to_csv(cursor, query, file_prefix, max_rows_per_shard, *shard_args)
+    elif engine == "python":
+        return _stream_shards(cursor, query, file_prefix, batch_size, max_rows_per_shard, itersize, *shard_args,
+                              output_format)
+    else:
+        raise ValueError(f"Unknown export engine: {engine}")
+
+
+def _copy_to_csv(cursor, query, file_prefix, max_rows_per_shard, pbar, sink, first_shard, on_shard):
+    writer = CopyShardWriter(file_prefix, max_rows_per_shard, pbar, sink, first_shard, on_shard)
+    try:
+        with metrics.timer("copy_seconds"):
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", writer)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.generated_files
+
+
+class CsvShardWriter(object):
+    """Writes batches of rows to a CSV shard, starting with a header row."""
+
+    def __init__(self, f, description):
+        self.f = io.TextIOWrapper(f, encoding='utf-8', newline='')
+        self.encoder = CsvEncoder(description, "postgres")
+        self.f.write(self.encoder.header())
+
+    def write_rows(self, rows):
+        with metrics.timer("csv_encode_seconds"):
+            text = self.encoder.encode(rows)
+        self.f.write(text)
+
+    def close(self):
+        return _close_shard(self.f)
+
+    def abort(self):
+        _abort_shard(self.f)
+
+
+SHARD_FORMATS = {
+    "csv": (".csv", CsvShardWriter),
+    "parquet": (".parquet", lambda f, description: ParquetShardWriter(f, description, "postgres")),
+}
+
+
+def _stream_shards(cursor, query, file_prefix, batch_size, max_rows_per_shard, itersize, pbar, sink, first_shard,
+                   on_shard, output_format):
+    extension, shard_writer = SHARD_FORMATS[output_format]
+    generated_files = []
+
+    # A named cursor created without a cursor_factory yields plain tuples, not DictRows.
+    with cursor.connection.cursor(name=f"{file_prefix}_export") as stream:
+        stream.itersize = itersize
+        stream.execute(query)
+
+        writer = None
+        shard_num = first_shard - 1
+        shard_rows = 0
+        fetch_seconds = metrics.registry.histogram("db_fetch_seconds")
+        write_seconds = metrics.registry.histogram("shard_write_seconds")
+        exported_rows = metrics.registry.counter("rows_exported")
+        try:
             while True:
-                cursor.execute(f"SELECT * FROM {schema_name}.{table_name} LIMIT {batch_size} OFFSET {offset}")
-                rows = cursor.fetchall()
+                started = time.perf_counter()
+                rows = list(islice(stream, min(batch_size, max_rows_per_shard - shard_rows)))
+                fetch_seconds.observe(time.perf_counter() - started)
                 if not rows:
                     break
-                if offset == (shard_num - 1) * max_rows_per_shard:  # first batch of the shard
-                    csv_writer.writerow([desc[0] for desc in cursor.description])  # header
-                csv_writer.writerows(rows)
-                shard_pbar.update(len(rows))
-                offset += batch_size
-        shard_pbar.close()
-    
+                if writer is None:
+                    shard_num += 1
+                    file_name = f"{file_prefix}_shard_{shard_num}{extension}"
+                    generated_files.append(file_name)
+                    logging.info(f"Creating {file_name}")
+                    writer = shard_writer(sink.open(file_name), stream.description)
+                started = time.perf_counter()
+                writer.write_rows(rows)
+                write_seconds.observe(time.perf_counter() - started)
+                exported_rows.inc(len(rows))
+                shard_rows += len(rows)
+                pbar.update(len(rows))
+                if shard_rows >= max_rows_per_shard:
+                    size = writer.close()
+                    writer = None
+                    if on_shard is not None:
+                        on_shard(file_name, shard_rows, size)
+                    shard_rows = 0
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            size = writer.close()
+            if on_shard is not None:
+                on_shard(file_name, shard_rows, size)
+
     return generated_files
 
 
@@ -130,16 +887,18 @@ class ThreadedConnection(object):
 
 
 def get_conn(*, database, user, password, host):
-    logging.info(f"Connecting to database: {database}, user: {user}, host: {host}, port: {port}")
-
+    """Return a context manager that checks a connection out of the (shared) pool for these credentials."""
     key = (database, user, password, host)
-    __POOLS[key] = ThreadedConnectionPool(__MIN_CONNECTIONS,
-                                          __MAX_CONNECTIONS,
-                                          user=user,
-                                          password=password,
-                                          host=host,
-                                          port=port,
-                                          database=database)
+    with __POOLS_LOCK:
+        if key not in __POOLS:
+            logging.info(f"Connecting to database: {database}, user: {user}, host: {host}, port: {port}")
+            __POOLS[key] = ThreadedConnectionPool(__MIN_CONNECTIONS,
+                                                  __MAX_CONNECTIONS,
+                                                  user=user,
+                                                  password=password,
+                                                  host=host,
+                                                  port=port,
+                                                  database=database)
     conn = ThreadedConnection(__POOLS[key])
     return conn
 
@@ -157,7 +916,169 @@ def get_cursor(conn=None, cursor_factory=DictCursor, **kwargs):
             cursor.close()
 
 
-def postgres_to_csv(schema_name, batch_size=1000):
+def export_table(cursor, schema_name, table_name, output_folder, batch_size=1000, itersize=10000, engine="python",
+                 table_workers=1, sink=None, manifest=None, run_id=None, watermark_columns=None, checkpoint=None,
+                 output_format="csv", max_rows_per_shard=200000):
+    progress = checkpoint.table(table_name) if checkpoint is not None else {}
+    if progress.get('done'):
+        logging.info(f"Skipping {table_name}, already exported according to the checkpoint.")
+        return
+
+    increment = [None, None, None]
+    if manifest is not None:
+        # A resumed table finishes the increment it started instead of computing a new one.
+        increment = progress.get('increment') or _increment(cursor, schema_name, table_name, manifest, run_id,
+                                                            watermark_columns)
+        if increment is None:
+            if checkpoint is not None:
+                checkpoint.finish_table(table_name)
+            return
+    where, file_prefix, entry = increment
+    # A full export, or the first increment of a table, holds all of its rows: any other shard is stale.
+    from_scratch = entry is None or ('since' in entry and entry['since'] is None)
+
+    export_args = dict(max_rows_per_shard=max_rows_per_shard, itersize=itersize, engine=engine, sink=sink,
+                       where=where, file_prefix=file_prefix, output_format=output_format)
+    primary_key = primary_key_columns(cursor, schema_name, table_name) if checkpoint is not None else []
+    if len(primary_key) == 1:
+        key = primary_key[0][0]
+        checkpoint.start_table(table_name, key=key, increment=increment)
+        generated_files = _export_table_in_key_ranges(cursor, schema_name, table_name, output_folder, key,
+                                                      batch_size, checkpoint, progress.get('shards', []), export_args)
+        uploaded = generated_files is not None
+        replaced = from_scratch
+    else:
+        if checkpoint is not None:
+            checkpoint.start_table(table_name, increment=increment)
+        if table_workers > 1:
+            generated_files = table_to_csv_parallel(cursor, schema_name, table_name, table_workers, batch_size,
+                                                    **export_args)
+        else:
+            generated_files = table_to_csv(cursor, schema_name, table_name, batch_size, **export_args)
+        # Shards streamed to S3 are already uploaded. The table was just read in full, under the same shard names as
+        # a crashed checkpointed run or, for a table without a watermark, the previous incremental run; shards of the
+        # same name in S3 are from an older read of the data and have to be replaced.
+        overwrite = checkpoint is not None or (manifest is not None and entry is None)
+        uploaded = isinstance(sink, S3Sink) or _upload_generated_files(generated_files, schema_name, output_folder,
+                                                                       overwrite=overwrite)
+        # Plain exports from disk keep skipping shards that are already in S3, and with them the older ones.
+        replaced = from_scratch and (entry is not None or overwrite or isinstance(sink, S3Sink))
+
+    if not uploaded:
+        if entry is not None:
+            logging.warning(f"Not all shards of {table_name} were uploaded, keeping its previous watermark.")
+        return
+    if replaced:
+        keys = {sink.key(f) if isinstance(sink, S3Sink) else os.path.join(output_folder, f) for f in generated_files}
+        remove_stale_shards(bucket_name, schema_name, table_name, keys)
+    if entry is not None:
+        manifest.update(table_name, entry)
+    if checkpoint is not None:
+        checkpoint.finish_table(table_name)
+
+
+def _export_table_in_key_ranges(cursor, schema_name, table_name, output_folder, key, batch_size, checkpoint,
+                                committed_shards, export_args):
+    """Export (the rest of) a table shard by shard, committing each uploaded shard to the checkpoint.
+
+    Returns the names of all of the table's shards, or None if one of them could not be uploaded.
+    """
+    generated_files = [shard['file'] for shard in committed_shards]
+    if committed_shards and committed_shards[-1]['last_key'] is None:
+        return generated_files
+    after = committed_shards[-1]['last_key'] if committed_shards else None
+    shards = iter_keyset_shards(cursor, schema_name, table_name, key, batch_size, after=after,
+                                first_shard=len(committed_shards) + 1, **export_args)
+    with closing(shards):
+        for file_name, rows, size, lower, upper in shards:
+            # A fresh run rewrites every key range, so a shard of the same name in S3 is stale and gets replaced.
+            if not isinstance(export_args['sink'], S3Sink) and \
+                    not _upload_generated_files([file_name], schema_name, output_folder, overwrite=True):
+                return None
+            checkpoint.add_shard(table_name, {'file': file_name, 'rows': rows, 'bytes': size,
+                                              'after': lower, 'last_key': upper})
+            generated_files.append(file_name)
+    return generated_files
+
+
+def _upload_generated_files(generated_files, schema_name, output_folder, overwrite=False):
+    """Upload shard files to S3 under the schema's folder. Unless `overwrite`, shards already in S3 are skipped."""
+    uploaded = True
+    for csv_file_name in generated_files:
+        csv_file_name_to_check = csv_file_name  # Update this if needed
+
+        if not overwrite and check_file_exists_in_s3(bucket_name, csv_file_name_to_check, schema_name):
+            logging.info(f"Skipping {csv_file_name}, already uploaded to S3.")
+            os.remove(csv_file_name)
+            continue
+
+        full_csv_path = os.path.join(output_folder, csv_file_name)
+        os.rename(csv_file_name, full_csv_path)
+
+        if upload_file_to_s3(full_csv_path, bucket_name):
+            if os.path.exists(full_csv_path):
+                os.remove(full_csv_path)
+            else:
+                logging.warning(f"{csv_file_name} does not exist on the local filesystem.")
+        else:
+            uploaded = False
+    return uploaded
+
+
+def _export_table_worker(schema_name, table_name, output_folder, **export_args):
+    # Each worker checks out its own pooled connection; the pool rolls back failed transactions on putconn.
+    with get_cursor(database=database, user=user, password=password, host=host) as cursor:
+        _timed_export_table(cursor, schema_name, table_name, output_folder, **export_args)
+
+
+def _timed_export_table(cursor, schema_name, table_name, output_folder, **export_args):
+    """`export_table`, with everything it records in metrics labelled with the table."""
+    with metrics.labels(exporter="postgres", table=table_name), metrics.timer("table_export_seconds"):
+        try:
+            export_table(cursor, schema_name, table_name, output_folder, **export_args)
+        except Exception:
+            metrics.inc("table_failures")
+            raise
+
+
+def postgres_to_csv(schema_name, batch_size=1000, itersize=10000, engine="python", workers=1, table_workers=1,
+                    parallel_table_min_size=PARALLEL_TABLE_MIN_SIZE, sink="disk", compression=None, incremental=False,
+                    watermark_columns=None, checkpoint=False, resume=False, output_format="csv",
+                    max_rows_per_shard=200000):
+    """Export every table of a schema to CSV shards and upload them to S3.
+
+    With `workers > 1` tables are exported concurrently, one pooled connection per worker (capped at
+    MAX_DB_CONNECTIONS), largest tables first so the longest exports don't start last. With
+    `table_workers > 1` tables of at least `parallel_table_min_size` bytes are additionally split across
+    that many connections each (see `table_to_csv_parallel`).
+
+    `sink="disk"` writes each shard locally and uploads it afterwards; `sink="s3"` streams shards straight
+    into S3 multipart uploads, optionally compressed with a `compression.Codec` spec such as `compression="gzip"`
+    or `"zstd:9"`. `output_format="parquet"` writes typed Parquet shards instead of CSV (see `table_to_csv`).
+
+    With `incremental=True` each table with a watermark column (`watermark_columns` maps table names to
+    columns, otherwise see `find_watermark_column`) only exports rows past the watermark recorded in the
+    schema's manifest, as `{table}_delta_{run_id}_shard_N.csv`. Tables without one, or whose
+    watermark column is nullable, are exported in full.
+
+    With `checkpoint=True` progress is recorded in an `ExportCheckpoint`: tables with a single-column primary
+    key are exported in key-range shards (see `iter_keyset_shards`) committed one by one, other tables as a
+    whole. `resume=True` continues from an existing checkpoint, skipping finished tables and shards. The checkpoint
+    is removed once every table has been exported.
+    """
+    if output_format not in SHARD_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if engine == "copy" and output_format != "csv":
+        raise ValueError("The copy engine only writes CSV, use engine='python' for other formats")
+    if sink == "s3":
+        shard_sink = S3Sink(bucket_name, schema_name, compression)
+    elif sink == "disk":
+        if compression is not None:
+            raise ValueError("compression is only supported with sink='s3'")
+        shard_sink = None
+    else:
+        raise ValueError(f"Unknown sink: {sink}")
+
     logging.info(f"Exporting all tables from schema {schema_name}...")
 
     with get_cursor(database=database, user=user, password=password, host=host) as cursor:
@@ -169,47 +1090,90 @@ def postgres_to_csv(schema_name, batch_size=1000):
             ORDER BY size;""")
         tables = cursor.fetchall()
 
-        total_tables = len(tables)
-        logging.info(f"Total tables to export: {total_tables}")
+    total_tables = len(tables)
+    logging.info(f"Total tables to export: {total_tables}")
 
-        output_folder = schema_name
-        os.makedirs(output_folder, exist_ok=True)
+    output_folder = schema_name
+    os.makedirs(output_folder, exist_ok=True)
 
-        ensure_bucket_exists(bucket_name)
-        
-        pbar = tqdm(total=total_tables, desc="Exporting tables")
-        for i, table in enumerate(tables):
-            table_name = table[0]
-            try:
-                generated_files = table_to_csv(cursor, schema_name, table_name, batch_size)
-                for csv_file_name in generated_files:
-                    csv_file_name_to_check = csv_file_name  # Update this if needed
-
-                    if check_file_exists_in_s3(bucket_name, csv_file_name_to_check, schema_name):
-                        logging.info(f"Skipping {csv_file_name}, already uploaded to S3.")
-                        continue
-
-                    full_csv_path = os.path.join(output_folder, csv_file_name)
-                    os.rename(csv_file_name, full_csv_path)
-
-                    if upload_file_to_s3(full_csv_path, bucket_name):
-                        if os.path.exists(full_csv_path):
-                            os.remove(full_csv_path)
-                        else:
-                            logging.warning(f"{csv_file_name} does not exist on the local filesystem.")
-
-                logging.info(f"Progress: {i + 1}/{total_tables} tables exported.")
-            except Exception as e:
-                logging.error(f"Failed to export table {table_name}. Error: {e}")
-            pbar.update(1)
-        pbar.close()
+    ensure_bucket_exists(bucket_name)
+    if shard_sink is None:
+        load_s3_key_index(bucket_name, schema_name)
+    manifest = ExportManifest(bucket_name, schema_name) if incremental else None
+    export_checkpoint = ExportCheckpoint(schema_name, resume) if checkpoint or resume else None
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
-        logging.info("All tables exported.")
+    if workers > __MAX_CONNECTIONS:
+        logging.warning(f"Only {__MAX_CONNECTIONS} database connections available, using that many workers.")
+        workers = __MAX_CONNECTIONS
+    # Every exporting thread holds its own connection plus one per table worker.
+    if table_workers > 1 and workers * (table_workers + 1) > __MAX_CONNECTIONS:
+        table_workers = max(__MAX_CONNECTIONS // workers - 1, 1)
+        logging.warning(f"Not enough database connections, using {table_workers} workers per large table.")
+
+    def table_args(size):
+        return dict(batch_size=batch_size, max_rows_per_shard=max_rows_per_shard, itersize=itersize, engine=engine,
+                    sink=shard_sink,
+                    table_workers=table_workers if size >= parallel_table_min_size else 1,
+                    manifest=manifest, run_id=run_id, watermark_columns=watermark_columns,
+                    checkpoint=export_checkpoint, output_format=output_format)
+
+    failed_tables = []
+    pbar = tqdm(total=total_tables, desc="Exporting tables")
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_export_table_worker, schema_name, table[0], output_folder,
+                                **table_args(table[1])): table[0]
+                for table in sorted(tables, key=lambda t: t[1], reverse=True)
+            }
+            for i, future in enumerate(as_completed(futures)):
+                table_name = futures[future]
+                try:
+                    future.result()
+                    logging.info(f"Progress: {i + 1}/{total_tables} tables exported.")
+                except Exception as e:
+                    logging.error(f"Failed to export table {table_name}. Error: {e}")
+                    failed_tables.append(table_name)
+                pbar.update(1)
+    else:
+        with get_cursor(database=database, user=user, password=password, host=host) as cursor:
+            for i, table in enumerate(tables):
+                table_name = table[0]
+                try:
+                    _timed_export_table(cursor, schema_name, table_name, output_folder, **table_args(table[1]))
+                    logging.info(f"Progress: {i + 1}/{total_tables} tables exported.")
+                except Exception as e:
+                    logging.error(f"Failed to export table {table_name}. Error: {e}")
+                    failed_tables.append(table_name)
+                    cursor.connection.rollback()
+                pbar.update(1)
+    pbar.close()
+
+    if failed_tables:
+        logging.error(f"{len(failed_tables)} tables failed to export: {', '.join(failed_tables)}")
+        if export_checkpoint is not None:
+            logging.info(f"Keeping {export_checkpoint.path}, continue with --resume")
+        return
+    if export_checkpoint is not None:
+        export_checkpoint.remove()
+    logging.info("All tables exported.")
 
 
 if __name__ == "__main__":
-    remove_all_csv_files('transactional')
-    postgres_to_csv('transactional')
+    parser = argparse.ArgumentParser(description="Export every table of a warehouse schema to S3.")
+    parser.add_argument("schema", nargs="?", default="transactional")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="record progress so an interrupted export can be resumed with --resume")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted export from its checkpoint")
+    args = parser.parse_args()
+
+    if not args.resume:
+        remove_all_csv_files(args.schema)
+    try:
+        postgres_to_csv(args.schema, checkpoint=args.checkpoint, resume=args.resume)
+    finally:
+        metrics.write_reports()
 
     # postgres_to_csv('county_deeds_public')
     # postgres_to_csv('greatcontrol')
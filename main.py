@@ -1,64 +1,208 @@
+import io
 import os
+import json
+import time
+import threading
 import mysql.connector
-import csv
+from mysql.connector import pooling
+from concurrent.futures import ThreadPoolExecutor
 import zipfile
 import logging
+from parquet_writer import ParquetShardWriter
+from csv_encoder import CsvEncoder
+from mysql_tables import decimal_columns, list_tables_by_size
+from compression import Codec, BackgroundCompressor, CompressionReport, COMPRESSION_CHUNK_SIZE, EXPORT_CODEC
+import metrics
 
 
 logging.basicConfig(level=logging.INFO)
 
+DB_CONFIG = {
+    'host': "noho.oa.rentmanager.com",
+    'user': "noho",
+    'database': "noho_rm12",
+    'password': "bO7RaphI",
+}
+MYSQL_EXPORT_WORKERS = int(os.getenv("MYSQL_EXPORT_WORKERS", "1"))
+MANIFEST_ENTRY = "manifest.json"
 
-def table_to_csv(cursor, table_name):
+
+def table_to_csv(cursor, table_name, zipf, output_format="csv", batch_size=10000, codec=None, report=None):
+    """Stream `table_name` into a new entry of the open archive `zipf` and return the entry name.
+
+    Rows are read from an unbuffered cursor `batch_size` at a time and written straight into the archive, so memory
+    stays bounded by one batch whatever the size of the table. CSV entries are compressed with `codec` (a `Codec`,
+    by default EXPORT_CODEC) on a background thread, and their ratio and throughput are added to `report`.
+    """
     logging.info(f"Exporting table {table_name}...")
+    if output_format == "parquet":
+        return table_to_parquet(cursor, table_name, zipf, batch_size)
+    elif output_format != "csv":
+        raise ValueError(f"Unknown output format: {output_format}")
     cursor.execute(f"SELECT * FROM {table_name}")
 
-    result = cursor.fetchall()
-
-    csv_file_name = f"{table_name}.csv"
+    codec = codec or Codec()
+    entry_name = os.path.join("csv_files", f"{table_name}.csv")
+    rows_written = 0
+
+    fetch_seconds = metrics.registry.histogram("db_fetch_seconds")
+    encode_seconds = metrics.registry.histogram("csv_encode_seconds")
+    write_seconds = metrics.registry.histogram("entry_write_seconds")
+
+    entry = BackgroundCompressor(codec.open_entry(zipf, entry_name), codec)
+    with io.TextIOWrapper(io.BufferedWriter(entry, COMPRESSION_CHUNK_SIZE), encoding="utf-8", newline='') as f:
+        encoder = CsvEncoder(cursor.description, "mysql")
+        f.write(encoder.header())
+        while True:
+            started = time.perf_counter()
+            rows = cursor.fetchmany(batch_size)
+            encoding = time.perf_counter()
+            fetch_seconds.observe(encoding - started)
+            if not rows:
+                break
+            text = encoder.encode(rows)
+            writing = time.perf_counter()
+            encode_seconds.observe(writing - encoding)
+            # Blocks while the compression thread is behind.
+            f.write(text)
+            write_seconds.observe(time.perf_counter() - writing)
+            rows_written += len(rows)
+
+    entry_name += codec.extension
+    metrics.inc("rows_exported", rows_written)
+    metrics.inc("raw_bytes", entry.raw_bytes)
+    metrics.inc("compressed_bytes", zipf.getinfo(entry_name).compress_size)
+    if report is not None:
+        report.add(table_name, codec, entry.raw_bytes, zipf.getinfo(entry_name).compress_size, entry.seconds)
+    logging.info(f"Table {table_name} exported successfully ({rows_written} rows).")
+    return entry_name
+
+
+def table_to_parquet(cursor, table_name, zipf, batch_size=10000):
+    """Stream `table_name` into a Parquet entry of `zipf`, keeping column types."""
+    entry_name = os.path.join("csv_files", f"{table_name}.parquet")
+    decimals = decimal_columns(cursor, table_name)
+    cursor.execute(f"SELECT * FROM {table_name}")
 
-    # Write data to CSV
-    with open(csv_file_name, "w", newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([i[0] for i in cursor.description])  # Write headers
-        writer.writerows(result)  # Write data
+    # Parquet columns are already compressed, deflating them again only costs time.
+    info = zipfile.ZipInfo(entry_name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    writer = ParquetShardWriter(zipf.open(info, "w", force_zip64=True), cursor.description, "mysql",
+                                decimals=decimals)
+    try:
+        while True:
+            with metrics.timer("db_fetch_seconds"):
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            with metrics.timer("entry_write_seconds"):
+                writer.write_rows(rows)
+            metrics.inc("rows_exported", len(rows))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
 
     logging.info(f"Table {table_name} exported successfully.")
-    return csv_file_name
-
-
-def mysql_to_csv():
-    mydb = mysql.connector.connect(
-        host="noho.oa.rentmanager.com",
-        user="noho",
-        database="noho_rm12",
-        password="bO7RaphI"
-    )
-
-    cursor = mydb.cursor()
-
-    cursor.execute("SHOW TABLES")
-    tables = cursor.fetchall()
+    return entry_name
+
+
+def _export_tables_worker(mydb, tables, zip_file_name, output_format, batch_size, progress, codecs, report):
+    """Export tables taken from the shared `tables` iterator into the archive `zip_file_name` on its own connection.
+
+    The archive ends with a MANIFEST_ENTRY listing the entries of the tables exported completely and the tables that
+    failed. A zip entry cannot be taken back once written, so a table that fails midway leaves a truncated entry;
+    the manifest is what tells it apart from a complete one.
+    """
+    manifest = {"complete": [], "failed": []}
+    # Unbuffered, so rows are pulled from the server as they are written rather than loaded up front.
+    cursor = mydb.cursor(buffered=False)
+    try:
+        with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for table_name in tables:
+                try:
+                    codec = Codec(codecs.get(table_name, codecs[None]))
+                    with metrics.labels(exporter="mysql", table=table_name), metrics.timer("table_export_seconds"):
+                        entry_name = table_to_csv(cursor, table_name, zipf, output_format, batch_size, codec, report)
+                    manifest["complete"].append({"table": table_name, "entry": entry_name})
+                    progress(table_name)
+                except Exception as e:
+                    metrics.inc("table_failures", exporter="mysql", table=table_name)
+                    manifest["failed"].append({"table": table_name, "error": str(e)})
+                    logging.error(f"Failed to export table {table_name}, its entry in {zip_file_name} is incomplete "
+                                  f"and listed as failed in {MANIFEST_ENTRY}. Error: {e}")
+                    if mydb.unread_result:
+                        mydb.consume_results()
+            zipf.writestr(MANIFEST_ENTRY, json.dumps(manifest, indent=2))
+    finally:
+        cursor.close()
+        mydb.close()  # returns pooled connections to the pool
+    return zip_file_name
+
+
+def mysql_to_csv(output_format="csv", batch_size=10000, db_config=None, workers=MYSQL_EXPORT_WORKERS,
+                 codec=EXPORT_CODEC, table_codecs=None):
+    """Export every table of the Rent Manager database into `all_tables.zip`.
+
+    With `workers` > 1 tables are exported concurrently over a connection pool, biggest first, and each worker writes
+    its own archive part `all_tables_part<n>.zip`. CSV entries are compressed with `codec` ("deflate[:level]",
+    "zstd[:level]", "lz4[:level]" or "store"), overridden per table by `table_codecs`. Returns the names of the
+    archives written; check each archive's MANIFEST_ENTRY for tables that failed.
+    """
+    db_config = db_config or DB_CONFIG
+    codecs = {None: codec, **(table_codecs or {})}
+    for spec in codecs.values():
+        Codec(spec)  # fail on unknown codecs before connecting
+    report = CompressionReport()
+    workers = max(1, min(workers, pooling.CNX_POOL_MAXSIZE))
+
+    if workers == 1:
+        connections = [mysql.connector.connect(**db_config)]
+    else:
+        pool = pooling.MySQLConnectionPool(pool_name="rm_export", pool_size=workers, **db_config)
+        connections = [pool.get_connection() for _ in range(workers)]
+
+    cursor = connections[0].cursor()
+    tables = list_tables_by_size(cursor)
+    cursor.close()
 
     total_tables = len(tables)
-    logging.info(f"Total tables to export: {total_tables}")
-
-    os.makedirs("csv_files", exist_ok=True)
-
-    zip_file_name = "all_tables.zip"
-    with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for i, table in enumerate(tables):
-            table_name = table[0]
-            try:
-                csv_file_name = table_to_csv(cursor, table_name)
-                zipf.write(csv_file_name, os.path.join("csv_files", csv_file_name))
-                os.remove(csv_file_name)
-                logging.info(f"Progress: {i + 1}/{total_tables} tables exported.")
-            except Exception as e:
-                logging.error(f"Failed to export table {table_name}. Error: {e}")
-
-    mydb.close()
+    logging.info(f"Total tables to export: {total_tables} on {workers} connection(s)")
+
+    lock = threading.Lock()
+    remaining = iter(tables)
+    exported = []
+
+    def next_tables():
+        while True:
+            with lock:
+                table_name = next(remaining, None)
+            if table_name is None:
+                return
+            yield table_name
+
+    def progress(table_name):
+        with lock:
+            exported.append(table_name)
+            logging.info(f"Progress: {len(exported)}/{total_tables} tables exported.")
+
+    if workers == 1:
+        zip_file_names = [_export_tables_worker(connections[0], next_tables(), "all_tables.zip", output_format,
+                                                batch_size, progress, codecs, report)]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_export_tables_worker, mydb, next_tables(), f"all_tables_part{n + 1}.zip",
+                                       output_format, batch_size, progress, codecs, report)
+                       for n, mydb in enumerate(connections)]
+            zip_file_names = [future.result() for future in futures]
+
+    report.log()
     logging.info("All tables exported and zipped.")
+    return zip_file_names
 
 
 if __name__ == "__main__":
-    mysql_to_csv()
+    try:
+        mysql_to_csv()
+    finally:
+        metrics.write_reports()
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_REPORT_PATH = os.getenv("METRICS_REPORT_PATH", "run_metrics.json")
+METRICS_TEXTFILE_PATH = os.getenv("METRICS_TEXTFILE_PATH")
+METRICS_PREFIX = "rm_export"
+
+# Upper bounds, in seconds, of the latency histogram buckets; anything slower lands in +Inf.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) pairs, ending with +Inf."""
+        with self._lock:
+            counts = list(self.counts)
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry(object):
+    """Process-wide counters and latency histograms, each identified by a name and a set of labels.
+
+    Recording is a dict lookup and a short lock, so instrumentation is meant to stay on: call sites record per batch,
+    request or file, never per row. Labels set with `labels(...)` apply to everything recorded by the current thread
+    inside the block, so code that does not know which table it is working on is still attributed to it. Threads do
+    not inherit them: code that hands work to other threads captures `current_labels()` and passes them explicitly.
+    `write_reports` writes a JSON run report and, optionally, a Prometheus textfile for node_exporter.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._scope = threading.local()
+
+    def counter(self, name, **labels):
+        return self._get(self._counters, Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(self._histograms, Histogram, name, labels)
+
+    def inc(self, name, amount=1, **labels):
+        self.counter(name, **labels).inc(amount)
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the block took in the `name` histogram, whether or not it raised."""
+        histogram = self.histogram(name, **labels)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    @contextmanager
+    def labels(self, **labels):
+        previous = getattr(self._scope, "labels", {})
+        self._scope.labels = {**previous, **labels}
+        try:
+            yield
+        finally:
+            self._scope.labels = previous
+
+    def current_labels(self):
+        return dict(getattr(self._scope, "labels", {}))
+
+    def report(self):
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "counters": [{"name": name, "labels": dict(labels), "value": counter.value}
+                         for (name, labels), counter in self._sorted(self._counters)],
+            "histograms": [{"name": name, "labels": dict(labels), "count": histogram.count,
+                            "sum": round(histogram.sum, 6),
+                            "buckets": {_format_bound(bound): count for bound, count in histogram.cumulative()}}
+                           for (name, labels), histogram in self._sorted(self._histograms)],
+        }
+
+    def textfile(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, labels, counter in _by_name(self._sorted(self._counters)):
+            if labels is None:
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+                continue
+            lines.append(f"{METRICS_PREFIX}_{name}_total{_format_labels(labels)} {counter.value}")
+        for name, labels, histogram in _by_name(self._sorted(self._histograms)):
+            if labels is None:
+                lines.append(f"# TYPE {METRICS_PREFIX}_{name} histogram")
+                continue
+            for bound, count in histogram.cumulative():
+                bucket_labels = labels + (("le", _format_bound(bound)),)
+                lines.append(f"{METRICS_PREFIX}_{name}_bucket{_format_labels(bucket_labels)} {count}")
+            lines.append(f"{METRICS_PREFIX}_{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{METRICS_PREFIX}_{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, report_path=METRICS_REPORT_PATH, textfile_path=METRICS_TEXTFILE_PATH):
+        if report_path:
+            _write_atomically(report_path, json.dumps(self.report(), indent=2))
+            logging.info(f"Wrote run metrics to {report_path}")
+        if textfile_path:
+            _write_atomically(textfile_path, self.textfile())
+
+    def _sorted(self, metrics):
+        with self._lock:
+            return sorted(metrics.items())
+
+    def _get(self, metrics, factory, name, labels):
+        scope = getattr(self._scope, "labels", None)
+        if scope:
+            labels = {**scope, **labels}
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        metric = metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = metrics.setdefault(key, factory())
+        return metric
+
+
+def _by_name(items):
+    """Sorted metric items, each name preceded by a (name, None, None) marker for its TYPE line."""
+    previous = None
+    for (name, labels), metric in items:
+        if name != previous:
+            yield name, None, None
+            previous = name
+        yield name, labels, metric
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _write_atomically(path, text):
+    # node_exporter may read the textfile at any moment, so it is replaced in one step.
+    part_path = f"{path}.part"
+    with open(part_path, "w") as f:
+        f.write(text)
+    os.replace(part_path, path)
+
+
+registry = MetricsRegistry()
+
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+labels = registry.labels
+current_labels = registry.current_labels
+write_reports = registry.write_reports
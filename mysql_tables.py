@@ -0,0 +1,32 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The Rent Manager MySQL database, configured by RM_DB_* in the environment or .env.
+DB_CONFIG = {
+    'host': os.getenv("RM_DB_HOST"),
+    'user': os.getenv("RM_DB_USER"),
+    'database': os.getenv("RM_DB_DATABASE"),
+    'password': os.getenv("RM_DB_PASSWORD"),
+}
+
+
+def list_tables_by_size(cursor):
+    """Names of the tables in the current database, biggest first, so long exports start early."""
+    cursor.execute(
+        "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+        "ORDER BY COALESCE(DATA_LENGTH, 0) + COALESCE(INDEX_LENGTH, 0) DESC, TABLE_NAME"
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def decimal_columns(cursor, table_name):
+    """{column name: (precision, scale)} of the DECIMAL columns of a table, which mysql.connector does not report."""
+    cursor.execute(
+        "SELECT COLUMN_NAME, NUMERIC_PRECISION, NUMERIC_SCALE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND DATA_TYPE = 'decimal'",
+        (table_name,)
+    )
+    return {name: (precision, scale) for name, precision, scale in cursor.fetchall()}
@@ -0,0 +1,156 @@
+import io
+import os
+import json
+from functools import partial
+
+from csv_encoder import MYSQL_BINARY_FLAG, MYSQL_BINARY_CHARSET
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "100000"))
+
+MYSQL_UNSIGNED_FLAG = 32
+
+
+def _postgres_type(column):
+    oid = column.type_code
+    if oid == 16:
+        return pa.bool_()
+    elif oid == 21:
+        return pa.int16()
+    elif oid == 23:
+        return pa.int32()
+    elif oid in (20, 26):
+        return pa.int64()
+    elif oid == 700:
+        return pa.float32()
+    elif oid == 701:
+        return pa.float64()
+    elif oid == 1700 and column.precision and column.precision <= 38:
+        return pa.decimal128(column.precision, column.scale or 0)
+    elif oid == 1082:
+        return pa.date32()
+    elif oid == 1083:
+        return pa.time64('us')
+    elif oid == 1114:
+        return pa.timestamp('us')
+    elif oid == 1184:
+        return pa.timestamp('us', tz='UTC')
+    elif oid == 1186:
+        return pa.duration('us')
+    elif oid == 17:
+        return pa.binary()
+    return None
+
+
+def _mysql_type(column, decimals):
+    type_code, flags, charset = column[1], column[7], column[8] if len(column) > 8 else None
+    unsigned = flags & MYSQL_UNSIGNED_FLAG
+    if type_code == 1:
+        return pa.uint8() if unsigned else pa.int8()
+    elif type_code in (2, 13):
+        return pa.uint16() if unsigned else pa.int16()
+    elif type_code in (3, 9):
+        return pa.uint32() if unsigned else pa.int32()
+    elif type_code == 8:
+        return pa.uint64() if unsigned else pa.int64()
+    elif type_code == 4:
+        return pa.float32()
+    elif type_code == 5:
+        return pa.float64()
+    elif type_code in (0, 246) and column[0] in decimals and decimals[column[0]][0] <= 38:
+        return pa.decimal128(*decimals[column[0]])
+    elif type_code in (10, 14):
+        return pa.date32()
+    elif type_code == 11:
+        return pa.duration('us')
+    elif type_code in (7, 12):
+        return pa.timestamp('us')
+    elif type_code in (249, 250, 251, 252, 253, 254) and (charset == MYSQL_BINARY_CHARSET or flags & MYSQL_BINARY_FLAG):
+        return pa.binary()
+    return None
+
+
+def arrow_schema(description, dialect, decimals=None):
+    """Build an Arrow schema from a DB-API `cursor.description`.
+
+    `dialect` is "postgres" (psycopg2 type OIDs) or "mysql" (mysql.connector field types). mysql.connector does not
+    report the precision and scale of DECIMAL columns, so `decimals` maps their names to (precision, scale), see
+    `mysql_tables.decimal_columns`. Types without a faithful Arrow equivalent (json, uuid, arrays, unconstrained
+    numerics, decimals of more than 38 digits or missing from `decimals`, ...) are stored as text. Returns the schema
+    and the indexes of the columns whose values have to be converted to text.
+    """
+    if pa is None:
+        raise ValueError("Parquet output requires the pyarrow package")
+    column_type = _postgres_type if dialect == "postgres" else partial(_mysql_type, decimals=decimals or {})
+
+    fields = []
+    text_columns = []
+    for i, column in enumerate(description):
+        arrow_type = column_type(column)
+        if arrow_type is None:
+            arrow_type = pa.string()
+            text_columns.append(i)
+        fields.append(pa.field(column[0], arrow_type))
+    return pa.schema(fields), text_columns
+
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode('utf-8', errors='replace')
+    return str(value)
+
+
+class ParquetShardWriter(object):
+    """Writes batches of DB-API rows into a Parquet file.
+
+    Column types come from `cursor.description` and, for MySQL, `decimals` (see `arrow_schema`). Rows are buffered into row groups of
+    `row_group_size` rows and every column is compressed with `compression`. `f` is any writable binary file
+    object; it is closed by `close()`.
+    """
+
+    def __init__(self, f, description, dialect, compression=PARQUET_COMPRESSION, row_group_size=PARQUET_ROW_GROUP_SIZE,
+                 decimals=None):
+        self.f = f
+        self.schema, self.text_columns = arrow_schema(description, dialect, decimals)
+        self.writer = pq.ParquetWriter(f, self.schema, compression=compression)
+        self.row_group_size = row_group_size
+        self._rows = []
+
+    def write_rows(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def close(self):
+        """Finish the file and return its size in bytes, or None when `f` cannot report its position."""
+        if self._rows:
+            self._write_row_group()
+        self.writer.close()
+        try:
+            size = self.f.tell()
+        except io.UnsupportedOperation:  # e.g. zip archive entries
+            size = None
+        self.f.close()
+        return size
+
+    def abort(self):
+        getattr(self.f, 'abort', self.f.close)()
+
+    def _write_row_group(self):
+        columns = [list(column) for column in zip(*self._rows)]
+        for i in self.text_columns:
+            columns[i] = [_to_text(value) for value in columns[i]]
+        arrays = [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=len(self._rows))
+        self._rows = []
@@ -0,0 +1,139 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class _Stage(object):
+    def __init__(self, name, handle, workers, queue_size):
+        self.name = name
+        self.handle = handle
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.items = 0
+        self.emitted = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._running = workers
+        self._lock = threading.Lock()
+
+
+class Pipeline(object):
+    """Runs a source and a chain of stages concurrently, each on its own threads, connected by bounded queues.
+
+    `stage(name, handle, workers)` adds a stage that calls `handle(item, emit)` for every item the previous stage
+    emitted; `emit(item)` passes an item on to the next stage. Every queue holds at most `queue_size` items, so a
+    slow stage blocks the ones feeding it instead of letting items pile up in memory. Errors are left to handlers;
+    an exception escaping one stops the whole pipeline and is raised again by `run`.
+    """
+
+    def __init__(self, source, queue_size=PIPELINE_QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self._stop = threading.Event()
+        self._error = None
+
+    def stage(self, name, handle, workers=1):
+        self.stages.append(_Stage(name, handle, workers, self.queue_size))
+        return self
+
+    def run(self):
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._feed, name="pipeline-source", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(threading.Thread(target=self._work, args=(index,), name=f"pipeline-{stage.name}-{n}",
+                                            daemon=True)
+                           for n in range(stage.workers))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.log(time.perf_counter() - started)
+        if self._error is not None:
+            raise self._error
+
+    def log(self, elapsed):
+        for stage in self.stages:
+            utilization = (stage.busy - stage.blocked) / max(elapsed * stage.workers, 1e-6)
+            logging.info(f"Pipeline stage {stage.name}: {stage.items} in, {stage.emitted} out on {stage.workers} "
+                         f"workers, {utilization:.0%} busy, {stage.blocked:.1f}s blocked on the next stage")
+
+    def _put(self, index, item):
+        """Put `item` on the queue of stage `index`, waiting for room unless the pipeline stops."""
+        if index >= len(self.stages):
+            return
+        while True:
+            if self._stop.is_set():
+                raise PipelineAborted()
+            try:
+                self.stages[index].inbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _feed(self):
+        source = iter(self.source)
+        try:
+            for item in source:
+                self._put(0, item)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if hasattr(source, "close"):
+                source.close()  # let a generator source release what it holds when the pipeline stops early
+            if self.stages:
+                self.stages[0].inbox.put(_DONE)
+
+    def _work(self, index):
+        stage = self.stages[index]
+
+        def emit(item):
+            waited = time.perf_counter()
+            self._put(index + 1, item)
+            with stage._lock:
+                stage.emitted += 1
+                stage.blocked += time.perf_counter() - waited
+
+        try:
+            while True:
+                item = stage.inbox.get()
+                if item is _DONE:
+                    # Let the other workers of this stage see the end of the input too.
+                    stage.inbox.put(_DONE)
+                    break
+                if self._stop.is_set():
+                    continue  # drain, so upstream threads waiting for room can finish
+                started = time.perf_counter()
+                try:
+                    stage.handle(item, emit)
+                except PipelineAborted:
+                    pass
+                except Exception as e:
+                    logging.error(f"Pipeline stage {stage.name} failed. Error: {e}")
+                    self._fail(e)
+                with stage._lock:
+                    stage.items += 1
+                    stage.busy += time.perf_counter() - started
+        finally:
+            with stage._lock:
+                stage._running -= 1
+                last = stage._running == 0
+            if last and index + 1 < len(self.stages):
+                self.stages[index + 1].inbox.put(_DONE)
@@ -0,0 +1,92 @@
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+def normalize_url(url):
+    """Cache key for `url`: scheme and host lower-cased, query parameters sorted, fragment dropped."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)), safe=",()")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+
+class CachedResponse(object):
+    def __init__(self, body, etag, last_modified, stored_at, ttl):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = time.time() - stored_at < ttl
+
+    def validators(self):
+        """Conditional request headers that let the server answer 304 if the response has not changed."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """A SQLite file of API responses keyed by normalized URL.
+
+    Responses are fresh for `ttl` seconds. Stale responses that came with an ETag or Last-Modified header are kept so
+    they can be revalidated with a conditional request; the others count as misses. Once the cached bodies add up
+    to more than `max_bytes`, the least recently used ones are evicted. Safe to share between threads.
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                  key TEXT PRIMARY KEY,
+                                  body BLOB,
+                                  etag TEXT,
+                                  last_modified TEXT,
+                                  stored_at REAL,
+                                  accessed_at REAL,
+                                  size INTEGER)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def get(self, url):
+        key = normalize_url(url)
+        with self._lock:
+            row = self._conn.execute("SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        response = CachedResponse(*row, self.ttl)
+        if not response.fresh and not response.validators():
+            return None
+        return response
+
+    def put(self, url, body, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (normalize_url(url), body, etag, last_modified, now, now, len(body)))
+            self._evict()
+
+    def revalidated(self, url):
+        """Mark the cached response for `url` as fresh again after the server answered 304 Not Modified."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                               (now, now, normalize_url(url)))
+
+    def _evict(self):
+        total, = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
@@ -1,18 +1,44 @@
+import io
 import json
 import os
+import queue
+import codecs
 import logging
+import time
+import random
+import threading
 import urllib3
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 
 from dotenv import load_dotenv
-from urllib.error import HTTPError
+from response_cache import ResponseCache
+import metrics
+
+try:
+    import ijson
+except ImportError:  # incremental JSON parsing is optional
+    ijson = None
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
-http = urllib3.PoolManager()
+
+# Keep-alive connections kept per host; concurrent downloads need at least one each.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# urllib3 would otherwise retry 429/503 responses with a Retry-After header on its own, hiding the throttling from
+# rm_api_request's backoff and api_limiter; connection errors are still retried here.
+http = urllib3.PoolManager(maxsize=HTTP_POOL_SIZE, retries=urllib3.Retry(3, respect_retry_after_header=False))
 
 API_TOKEN = os.getenv("API_TOKEN")
+# Tokens are refreshed this many seconds after they were obtained, before the API starts rejecting them.
+API_TOKEN_TTL = int(os.getenv("API_TOKEN_TTL", "3000"))
+PERSIST_API_TOKEN = os.getenv("PERSIST_API_TOKEN", "false").lower() == "true"
+# After a failed authentication, callers fail straight away for this many seconds instead of all trying again.
+API_TOKEN_FAILURE_BACKOFF = float(os.getenv("API_TOKEN_FAILURE_BACKOFF", "30"))
 API_URL = os.getenv("RM_API_URL")
 API_CONFIG = {
     'username': os.getenv("RM_API_USERNAME"),
@@ -20,7 +46,23 @@ API_CONFIG = {
     'locationid': os.getenv("RM_API_LOCATION_ID"),
 }
 FILE_METADATA_FIELDS = ['FileID', 'Description', 'CreateDate', 'UpdateDate', 'CreateUserID', 'UpdateUserID']
-FOLDER="rm_files"
+
+# Longest request URL the Rent Manager API reliably accepts, and its paging.
+MAX_URL_LENGTH = int(os.getenv("RM_MAX_URL_LENGTH", "2000"))
+RM_PAGE_SIZE = int(os.getenv("RM_PAGE_SIZE", "500"))
+API_WORKERS = int(os.getenv("RM_API_WORKERS", "4"))
+API_MAX_CONCURRENCY = int(os.getenv("RM_API_MAX_CONCURRENCY", "16"))
+API_RETRIES = int(os.getenv("RM_API_RETRIES", "5"))
+API_RETRY_BASE_DELAY = float(os.getenv("RM_API_RETRY_BASE_DELAY", "0.5"))
+API_RETRY_MAX_DELAY = float(os.getenv("RM_API_RETRY_MAX_DELAY", "30"))
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+ENTITY_QUEUE_SIZE = 1000
+
+# Set RM_API_CACHE to a file path to cache API responses across runs.
+API_CACHE_PATH = os.getenv("RM_API_CACHE")
+API_CACHE_TTL = int(os.getenv("RM_API_CACHE_TTL", "86400"))
+API_CACHE_MAX_BYTES = int(os.getenv("RM_API_CACHE_MAX_BYTES", str(1024 ** 3)))
+response_cache = ResponseCache(API_CACHE_PATH, API_CACHE_TTL, API_CACHE_MAX_BYTES) if API_CACHE_PATH else None
 
 
 def update_dotenv(key, new_value):
@@ -45,7 +87,7 @@ def update_dotenv(key, new_value):
         file.writelines(lines)
 
 
-def refresh_token():
+def refresh_token(persist=True):
     auth_params = json.dumps(API_CONFIG)
     headers = {
         'Content-Type': 'application/json'
@@ -56,7 +98,8 @@ def refresh_token():
             token = resp.data.decode('utf-8')
             token = token[1:-1]
             if 'error' not in token:
-                update_dotenv("API_TOKEN", token)
+                if persist:
+                    update_dotenv("API_TOKEN", token)
                 return token
             else:
                 logging.error(f"Error in API response: {token['error']}")
@@ -69,35 +112,306 @@ def refresh_token():
         return None
 
 
-def rm_api_request(url):
-    global API_TOKEN
-    try:
-        if not API_TOKEN:
+class TokenRefreshError(Exception):
+    pass
+
+
+class TokenManager(object):
+    """Caches the API token in memory and refreshes it once for all threads.
+
+    The token is considered stale `ttl` seconds after it was obtained and refreshed before use. When several callers
+    need a new token at the same time only the first re-authenticates; the others wait for it and reuse its token.
+    If authentication fails, they and every caller for the next `failure_backoff` seconds get that failure, a
+    TokenRefreshError, without authenticating again. With `persist` the new token is also written to `.env`.
+    """
+
+    def __init__(self, token=None, ttl=API_TOKEN_TTL, persist=PERSIST_API_TOKEN,
+                 failure_backoff=API_TOKEN_FAILURE_BACKOFF):
+        self.ttl = ttl
+        self.persist = persist
+        self.failure_backoff = failure_backoff
+        self._token = token
+        self._expires_at = time.monotonic() + ttl if token else 0
+        self._failed_until = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        token = self._token
+        if token and time.monotonic() < self._expires_at:
+            return token
+        return self.refresh(stale=token)
+
+    def refresh(self, stale=None):
+        """Return a fresh token, re-authenticating unless another caller already replaced `stale`."""
+        with self._lock:
+            now = time.monotonic()
+            if self._token and self._token != stale and now < self._expires_at:
+                return self._token
+            if now < self._failed_until:
+                raise TokenRefreshError("Rent Manager API authentication failed recently, not retrying yet")
             logging.info("Refreshing API token")
-            API_TOKEN = refresh_token()
-        content = resolve_http_report(url, headers=make_rm_headers())
-    except ReportFetchException as e:
-        if e.status == 401:
-            API_TOKEN = refresh_token()
-        else:
-            raise e
-        content = resolve_http_report(url, headers=make_rm_headers())
+            with metrics.timer("token_refresh_seconds"):
+                self._token = refresh_token(persist=self.persist)
+            if self._token is None:
+                metrics.inc("token_refresh_failures")
+                self._expires_at = 0
+                self._failed_until = time.monotonic() + self.failure_backoff
+                raise TokenRefreshError("Rent Manager API authentication failed")
+            self._expires_at = time.monotonic() + self.ttl
+            self._failed_until = 0
+            return self._token
+
+
+token_manager = TokenManager(API_TOKEN)
+
+
+class AdaptiveLimiter(object):
+    """Adapts how many API requests may be in flight at once to what the server sustains.
+
+    Starts at `initial` concurrent requests. Every healthy response raises the limit by 1/limit, so about one extra
+    slot per limit's worth of successes, up to `maximum`; other failures leave it as it is. A 429 or 503 halves it
+    (at most once per `decrease_interval` seconds, so one burst of rejections counts once), down to `minimum`. A
+    Retry-After on those responses pauses every caller until it has passed.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=16, decrease_interval=1.0):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self._paused_until = 0
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._condition.wait(timeout=pause if pause > 0 else None)
+            self.in_flight += 1
+
+    def release(self, throttled=False, retry_after=None, healthy=True):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._decreased_at >= self.decrease_interval:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased_at = now
+                    logging.info(f"Rent Manager API throttled, concurrency limit down to {int(self.limit)}")
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif healthy:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+api_limiter = AdaptiveLimiter(API_WORKERS, maximum=API_MAX_CONCURRENCY)
+
+
+def retry_after_seconds(response):
+    """Seconds asked for by a Retry-After header (delta-seconds or HTTP-date), or None."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
 
-    return content
 
+def retry_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter, never shorter than what the server asked for."""
+    delay = random.uniform(0, min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+def api_endpoint(url):
+    """The resource an API URL is about, e.g. "Checks", to label its metrics with."""
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def rm_api_request(url, resolve=None, hold_slot=False):
+    """Resolve `url` with retries, under `api_limiter`.
+
+    With `hold_slot`, a non-None result (a response whose body is still to be read) keeps its limiter slot; the
+    caller releases it with `api_limiter.release(healthy=...)` once the body is consumed.
+    """
+    resolve = resolve or (cached_http_report if response_cache is not None else resolve_http_report)
+    endpoint = api_endpoint(url)
+    token = token_manager.get()
+    refreshed = False
+    attempt = 0
+    while True:
+        api_limiter.acquire()
+        throttled, retry_after, healthy, held = False, None, False, False
+        started, outcome = time.perf_counter(), "ok"
+        try:
+            result = resolve(url, headers=make_rm_headers(token))
+            healthy = True
+            held = hold_slot and result is not None
+            return result
+        except ReportFetchException as e:
+            outcome = str(e.status)
+            if e.status == 401 and not refreshed:
+                token = token_manager.refresh(stale=token)
+                refreshed = True
+                continue
+            throttled = e.status in [429, 503]
+            retry_after = retry_after_seconds(e.response)
+            if e.status not in RETRY_STATUSES or attempt >= API_RETRIES:
+                raise e
+            error = f"HTTP {e.status}"
+        except urllib3.exceptions.HTTPError as e:
+            outcome = "connection_error"
+            if attempt >= API_RETRIES:
+                raise e
+            error = str(e)
+        finally:
+            if not held:
+                api_limiter.release(throttled, retry_after, healthy)
+            # Until the response is available: the headers for streamed bodies, the whole body otherwise.
+            metrics.observe("api_request_seconds", time.perf_counter() - started, endpoint=endpoint, outcome=outcome)
+            if throttled:
+                metrics.inc("api_throttled", endpoint=endpoint)
+
+        delay = retry_delay(attempt, retry_after)
+        attempt += 1
+        metrics.inc("api_retries", endpoint=endpoint)
+        logging.warning(f"Rent Manager API request failed ({error}), retry {attempt}/{API_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def iter_rm_api_entities(url):
+    """Yield the entities of a Rent Manager API list response as they are parsed off the connection.
+
+    With ijson installed the JSON array is parsed incrementally, so neither the raw body nor the decoded string is
+    ever held in memory; without it the body is loaded and parsed in one go. With the response cache enabled the
+    body is read whole, since it has to be stored, and parsed from memory.
+    """
+    if response_cache is not None:
+        body = rm_api_request(url, resolve=cached_http_body)
+        if body is not None:
+            yield from _parse_entities(io.BytesIO(body))
+        return
+
+    # The limiter slot is held until the body is read, so streamed pages count against the concurrency limit too.
+    resp = rm_api_request(url, resolve=stream_http_report, hold_slot=True)
+    if resp is None:
+        return
+    healthy = False
+    try:
+        yield from _parse_entities(resp)
+        healthy = True
+    finally:
+        resp.release_conn()
+        api_limiter.release(healthy=healthy)
 
-def make_rm_headers():
+
+def _parse_entities(f):
+    if ijson is None:
+        return json.loads(f.read().decode('utf-8-sig'))
+    return ijson.items(_SkipBom(f), 'item', use_float=True)
+
+
+def make_rm_headers(token=None):
     return {
-        "X-RM12Api-ApiToken": API_TOKEN
+        "X-RM12Api-ApiToken": token or token_manager.get()
     }
 
 
 class ReportFetchException(Exception):
     def __init__(self, response):
+        super().__init__(f"HTTP {response.status}")
         self.response = response
         self.status = response.status
 
 
+class _SkipBom(object):
+    """Readable view of a response that drops a leading UTF-8 byte order mark, which JSON parsers reject."""
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.started = False
+
+    def read(self, size=-1):
+        if size == 0:
+            return b""
+        data = self.resp.read(size if size > 0 else None)
+        if not self.started:
+            self.started = True
+            if data.startswith(codecs.BOM_UTF8):
+                data = data[len(codecs.BOM_UTF8):]
+        return data
+
+
+def stream_http_report(url, method="GET", body=None, headers=None, fields=None):
+    """Like `resolve_http_report`, but returns the unread response so its body can be streamed."""
+    resp = http.request(method, url, fields=fields, headers=headers, body=body, preload_content=False)
+    if resp.status in [200, 206]:
+        logging.debug(f"Streaming report from: {url}")
+        return resp
+    report_content = resp.read().decode('utf-8-sig', errors='replace')
+    resp.release_conn()
+    if resp.status in [204]:
+        logging.debug(f"Got report without content from: {url}")
+        return None
+    logging.error(f"""
+        Could not retrieve report:
+        URL: {url}
+        Headers: {resp.headers}
+        Body: {report_content}
+        """)
+    raise ReportFetchException(resp)
+
+
+def cached_http_body(url, headers=None):
+    """GET `url` through the response cache and return the raw body, or None if the server had no content.
+
+    A fresh cached response is returned without touching the network. A stale one is revalidated with
+    If-None-Match/If-Modified-Since when it has validators, and reused if the server answers 304 Not Modified.
+    """
+    cached = response_cache.get(url)
+    if cached is not None and cached.fresh:
+        logging.debug(f"Cached report for: {url}")
+        metrics.inc("api_cache_hits", endpoint=api_endpoint(url))
+        return cached.body or None
+
+    headers = dict(headers or {})
+    if cached is not None:
+        headers.update(cached.validators())
+    resp = http.request('GET', url, headers=headers)
+    if resp.status == 304 and cached is not None:
+        logging.debug(f"Cached report still valid for: {url}")
+        response_cache.revalidated(url)
+        metrics.inc("api_cache_revalidated", endpoint=api_endpoint(url))
+        return cached.body or None
+    elif resp.status in [200, 206, 204]:
+        metrics.inc("api_cache_misses", endpoint=api_endpoint(url))
+        body = resp.data if resp.status != 204 else b""
+        response_cache.put(url, body, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        return body or None
+    logging.error(f"""
+        Could not retrieve report:
+        URL: {url}
+        Headers: {resp.headers}
+        Body: {resp.data.decode('utf-8-sig', errors='replace')}
+        """)
+    raise ReportFetchException(resp)
+
+
+def cached_http_report(url, headers=None):
+    """`resolve_http_report` through the response cache."""
+    body = cached_http_body(url, headers)
+    return body.decode('utf-8-sig') if body is not None else None
+
+
 def resolve_http_report(url, method="GET", body=None, headers=None, fields=None):
     resp = http.request(method, url, fields=fields, headers=headers, body=body)
     report_content = resp.data.decode('utf-8-sig')
@@ -117,31 +431,111 @@ def resolve_http_report(url, method="GET", body=None, headers=None, fields=None)
         raise ReportFetchException(resp)
 
 
-def get_download_url(url, source_key, entity_key=None, paths_to_files=[]):
+def batch_ids(ids, url, max_url_length=MAX_URL_LENGTH, max_batch_size=None):
+    """Split `ids` into comma-joined batches that keep `url` plus the joined batch under `max_url_length`."""
+    batches = []
+    batch = []
+    length = len(url)
+    for entity_id in ids:
+        entity_id = str(entity_id)
+        if batch and (length + len(entity_id) + 1 > max_url_length or len(batch) == max_batch_size):
+            batches.append(','.join(batch))
+            batch = []
+            length = len(url)
+        batch.append(entity_id)
+        length += len(entity_id) + 1
+    if batch:
+        batches.append(','.join(batch))
+    return batches
+
+
+class _PageDone(object):
+    def __init__(self, url, page_number, count, error=None):
+        self.url = url
+        self.page_number = page_number
+        self.count = count
+        self.error = error
+
+
+def fetch_all_pages(urls, page_size=RM_PAGE_SIZE, workers=API_MAX_CONCURRENCY):
+    """Fetch every page of every url in `urls` concurrently and yield the decoded entities.
+
+    Pages are requested with `pagesize`/`pagenumber`; a full page queues the next page of the same url, so pages of
+    different urls and consecutive pages of one url are all in flight on the same pool of `workers` threads, within
+    what `api_limiter` currently allows. Entities are handed over through a bounded queue as they are parsed, so
+    memory does not grow with the response size.
+    """
+    results = queue.Queue(maxsize=ENTITY_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def fetch(url, page_number):
+        count = 0
+        try:
+            for entity in iter_rm_api_entities(f"{url}&pagesize={page_size}&pagenumber={page_number}"):
+                if stop.is_set():
+                    break
+                results.put(entity)
+                count += 1
+        except Exception as e:
+            results.put(_PageDone(url, page_number, count, e))
+        else:
+            results.put(_PageDone(url, page_number, count))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = 0
+        for url in urls:
+            executor.submit(fetch, url, 1)
+            in_flight += 1
+        try:
+            while in_flight:
+                item = results.get()
+                if not isinstance(item, _PageDone):
+                    yield item
+                    continue
+                in_flight -= 1
+                if item.error is not None:
+                    raise item.error
+                if item.count >= page_size:
+                    executor.submit(fetch, item.url, item.page_number + 1)
+                    in_flight += 1
+        finally:
+            # Let blocked workers finish so the executor can shut down.
+            stop.set()
+            while in_flight:
+                if isinstance(results.get(), _PageDone):
+                    in_flight -= 1
+
+
+def log_file(rm_entity, file_obj, metadata):
+    logging.info(f"get_download_url - Requesting {metadata} from {file_obj['DownloadURL']}")
+
+
+def get_download_url(url, source_key, entity_key=None, paths_to_files=[], on_file=log_file):
+    """Return a function that looks up the files attached to the entities of a dataset.
+
+    The entity ids in `dataset['payload']` are queried in batches short enough for the server to accept, with every
+    page of every batch fetched concurrently. `on_file(rm_entity, file_obj, metadata)` is called for each file that
+    has a DownloadURL; it is called from the calling thread only.
+    """
     if paths_to_files is None:
         paths_to_files = []
     entity_key = entity_key or source_key
 
     def get_file_url(dataset: dict) -> dict:
-        entity_ids = ','.join(set(str(e[0]) for e in dataset['payload']))
+        payload_index = {row[0]: row for row in dataset['payload']}
+        entity_ids = sorted(str(entity_key_id) for entity_key_id in payload_index)
         if not entity_ids:
             return dataset
 
-        entities_url = API_URL + url + "&filters={key},in,({ids})".format(key="FileAttachments.EntityKeyID", ids=entity_ids)
-        logging.debug(f"get_download_url - Fetching from {entities_url} ")
-
-        content = rm_api_request(entities_url)
-        if not content:
-            return dataset
-        for rm_entity in json.loads(content):
-            entity = None
-
-            for entity_key_id, in dataset['payload']:
-                if entity_key_id == rm_entity[entity_key]:
-                    entity = rm_entity[entity_key]
-                    break
+        filter_url = API_URL + url + "&filters=FileAttachments.EntityKeyID,in,({ids})"
+        # Keep room for the paging parameters; with at most RM_PAGE_SIZE ids a batch rarely needs a second page.
+        batches = batch_ids(entity_ids, filter_url.format(ids=""), MAX_URL_LENGTH - 40, RM_PAGE_SIZE)
+        entities_urls = [filter_url.format(ids=ids) for ids in batches]
+        logging.debug(f"get_download_url - Fetching {len(entity_ids)} entities in {len(batches)} batches")
 
-            assert entity, f"Entity not found for rm_entity: {rm_entity}"
+        for rm_entity in fetch_all_pages(entities_urls):
+            entity = rm_entity[entity_key]
+            assert entity in payload_index, f"Entity not found for rm_entity: {rm_entity}"
 
             files = []
             for path_to_files in paths_to_files:
@@ -157,8 +551,7 @@ def get_download_url(url, source_key, entity_key=None, paths_to_files=[]):
                 downloadURL = f.get('DownloadURL')
 
                 if downloadURL:
-                    logging.info(f"get_download_url - Requesting {metadata} from {downloadURL}")
-                    # fetch_file(downloadURL, format_file_name(f))
+                    on_file(rm_entity, f, metadata)
         return dataset
 
     return get_file_url
@@ -175,25 +568,41 @@ def get_path(obj, path):
     return new_obj
 
 
-def fetch_file(url, file_name):
-    logging.debug(f"Fetching file {file_name} from {url}")
-    sub_folder, actual_file_name = os.path.split(file_name)
-    folder = os.path.join(FOLDER, sub_folder)
+def stream_to_file(url, path, chunk_size=DOWNLOAD_CHUNK_SIZE, digest=None):
+    """Download `url` to `path` over the shared connection pool, `chunk_size` bytes at a time.
+
+    The file is written to `path.part` and renamed when complete; `digest`, a hashlib object, is fed every chunk.
+    Returns the number of bytes written, or None if the file does not exist (404); any other non-200 response
+    raises ReportFetchException.
+    """
+    started = time.perf_counter()
+    resp = http.request('GET', url, preload_content=False)
     try:
-        os.makedirs(folder, exist_ok=True)
-        source_file = urllib.request.urlopen(url)
-        path = os.path.join(folder, actual_file_name)
-        logging.info(path)
-        with open(path, 'wb') as f:
-            f.write(source_file.read())
-
-    except HTTPError as e:
-        logging.error(f"Download of {file_name} failed. {e}")
-        if e.code != 404:
-            raise e
-    except Exception as ex:
-        logging.error(f"Not sure what happened. {ex}")
-        raise ex
+        if resp.status == 404:
+            metrics.inc("downloads_not_found")
+            return None
+        elif resp.status != 200:
+            raise ReportFetchException(resp)
+
+        part_path = f"{path}.part"
+        size = 0
+        try:
+            with open(part_path, 'wb') as f:
+                for chunk in resp.stream(chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        os.replace(part_path, path)
+        metrics.observe("download_seconds", time.perf_counter() - started)
+        metrics.inc("downloaded_bytes", size)
+        return size
+    finally:
+        resp.release_conn()
 
 
 def format_file_name(file_obj):
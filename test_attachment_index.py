@@ -0,0 +1,26 @@
+from attachment_index import AttachmentIndex
+
+
+def store(index, file_id, update_date, content):
+    path = index.temp_path()
+    with open(path, "wb") as f:
+        f.write(content)
+    index.store(file_id, update_date, f"{file_id}/a.pdf", path, f"sha-{file_id}", len(content))
+
+
+def test_missing_lists_new_and_changed_files(tmp_path):
+    index = AttachmentIndex(str(tmp_path))
+    store(index, 1, "2024-01-01", b"one")
+    store(index, 2, "2024-01-01", b"two")
+
+    assert sorted(index.missing([(1, "2024-01-01"), (2, "2024-02-01"), (3, None)])) == [2, 3]
+
+
+def test_missing_with_uploaded_lists_files_not_uploaded_yet(tmp_path):
+    index = AttachmentIndex(str(tmp_path))
+    store(index, 1, "2024-01-01", b"one")
+    store(index, 2, "2024-01-01", b"two")
+    index.mark_uploaded(1)
+
+    assert index.missing([(1, "2024-01-01"), (2, "2024-01-01")], uploaded=True) == [2]
+    assert index.missing([(1, "2024-01-01"), (2, "2024-01-01")]) == []
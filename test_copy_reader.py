@@ -0,0 +1,43 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from warehouse_load import CopyReader, ZERO_DATE, _copy_nulls, _copy_value
+
+
+def read_all(reader, size=7):
+    data = b""
+    while True:
+        chunk = reader.read(size)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def test_text_escapes_copy_control_characters():
+    assert _copy_value("a\tb\nc\rd\\e\x00f", "text") == "a\\tb\\nc\\rd\\\\ef"
+
+
+def test_null_and_typed_values():
+    assert _copy_value(None, "text") == "\\N"
+    assert _copy_value(b"\x00\xff", "bytea") == "\\\\x00ff"
+    assert _copy_value(1, "boolean") == "t"
+    assert _copy_value(datetime(2024, 1, 2, 3, 4, 5), "timestamp") == "2024-01-02 03:04:05"
+    assert _copy_value(Decimal("1.50"), "numeric(10,2)") == "1.50"
+    assert _copy_value({"a": 1}, "jsonb") == '{"a": 1}'
+
+
+def test_rows_are_tab_separated_lines_across_reads():
+    rows = [(1, "x\ty", None), (2, "back\\slash", date(2024, 1, 1))]
+    reader = CopyReader(iter(rows), ["integer", "text", "date"])
+
+    assert read_all(reader) == b"1\tx\\ty\t\\N\n2\tback\\\\slash\t2024-01-01\n"
+    assert reader.row_count == 2
+
+
+def test_zero_dates_in_not_null_columns_are_loaded_as_the_sentinel():
+    # mysql.connector returns '0000-00-00' as None.
+    columns = [("due", "date", False, False), ("paid", "date", True, False), ("note", "text", False, False)]
+    rows = [(None, None, "a"), (date(2024, 1, 1), None, "b")]
+    reader = CopyReader(iter(rows), [pg_type for _, pg_type, _, _ in columns], _copy_nulls(columns))
+
+    assert read_all(reader) == f"{ZERO_DATE}\t\\N\ta\n2024-01-01\t\\N\tb\n".encode()
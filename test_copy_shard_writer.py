@@ -0,0 +1,24 @@
+from greatcontrol import CopyShardWriter
+
+
+def write_in_chunks(file_prefix, data, chunk_size, max_rows_per_shard=2):
+    writer = CopyShardWriter(file_prefix, max_rows_per_shard)
+    for i in range(0, len(data), chunk_size):
+        writer.write(data[i:i + chunk_size])
+    writer.close()
+    return writer.header, [open(name, "rb").read() for name in writer.generated_files]
+
+
+def test_quoted_header_split_across_writes(tmp_path):
+    # The first write ends inside the quoted header column.
+    header, shards = write_in_chunks(str(tmp_path / "t"), b'x,"abcdefgh"\n1,a\n2,b\n3,c\n', chunk_size=7)
+
+    assert header == b'x,"abcdefgh"\n'
+    assert shards == [b'x,"abcdefgh"\n1,a\n2,b\n', b'x,"abcdefgh"\n3,c\n']
+
+
+def test_quoted_newlines_in_rows(tmp_path):
+    header, shards = write_in_chunks(str(tmp_path / "t"), b'id,b\n1,"a\nb"\n2,c\n3,d\n', chunk_size=3)
+
+    assert header == b'id,b\n'
+    assert shards == [b'id,b\n1,"a\nb"\n2,c\n', b'id,b\n3,d\n']
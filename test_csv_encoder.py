@@ -0,0 +1,78 @@
+import io
+import csv
+from collections import namedtuple
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+
+from csv_encoder import CsvEncoder, MYSQL_BINARY_CHARSET, MYSQL_BINARY_FLAG
+
+VAR_STRING = 253
+LONG = 3
+DATETIME = 12
+NEWDECIMAL = 246
+
+Column = namedtuple("Column", "name type_code")
+
+
+def mysql_column(name, type_code, flags=0, charset=45):
+    return (name, type_code, None, None, None, None, 1, flags, charset)
+
+
+def csv_writer_output(names, rows):
+    f = io.StringIO(newline='')
+    writer = csv.writer(f)
+    writer.writerow(names)
+    writer.writerows(rows)
+    return f.getvalue()
+
+
+def encode(description, rows):
+    encoder = CsvEncoder(description, "mysql")
+    return encoder.header() + encoder.encode(rows)
+
+
+def test_bin_collated_text_is_quoted_like_csv_writer():
+    # utf8mb4_bin columns carry the BINARY flag, but mysql.connector returns their values as str.
+    description = [mysql_column("id", LONG), mysql_column("code", VAR_STRING, flags=MYSQL_BINARY_FLAG)]
+    rows = [(1, "b,1"), (2, 'say "hi"'), (3, "two\nlines"), (4, "plain"), (5, None), (6, "")]
+
+    assert encode(description, rows) == csv_writer_output(["id", "code"], [(i, "" if v is None else v)
+                                                                           for i, v in rows])
+
+
+def test_single_bin_collated_column_matches_csv_writer():
+    description = [mysql_column("code", VAR_STRING, charset=MYSQL_BINARY_CHARSET)]
+    rows = [("a,b",), ("",), ("x",)]
+
+    assert encode(description, rows) == csv_writer_output(["code"], rows)
+
+
+def test_binary_bytes_are_written_as_hex():
+    description = [mysql_column("id", LONG), mysql_column("data", VAR_STRING, charset=MYSQL_BINARY_CHARSET)]
+    rows = [(1, b"\x00,\xff"), (2, bytearray(b"ab")), (3, None)]
+
+    assert encode(description, rows) == "id,data\r\n1,\\x002cff\r\n2,\\x6162\r\n3,\r\n"
+
+
+def test_timestamps_always_have_microseconds():
+    description = [mysql_column("at", DATETIME)]
+    rows = [(datetime(2020, 1, 1),), (datetime(2020, 1, 1, 1, 1, 1, 5),), (None,)]
+
+    assert encode(description, rows) == "at\r\n2020-01-01 00:00:00.000000\r\n2020-01-01 01:01:01.000005\r\n\"\"\r\n"
+
+
+def test_postgres_dates_times_and_timestamps():
+    encoder = CsvEncoder([Column("d", 1082), Column("t", 1083), Column("ts", 1184)], "postgres")
+    rows = [(date(2020, 1, 1), time(1, 2, 3), datetime(2020, 1, 1, tzinfo=timezone.utc)),
+            (None, time(1, 2, 3, 400000), None)]
+
+    assert encoder.encode(rows) == ("2020-01-01,01:02:03.000000,2020-01-01 00:00:00.000000+00:00\r\n"
+                                    ",01:02:03.400000,\r\n")
+
+
+def test_decimals_are_never_in_scientific_notation():
+    description = [mysql_column("id", LONG), mysql_column("amount", NEWDECIMAL)]
+    rows = [(1, Decimal("1E+3")), (2, Decimal("0.0000001")), (3, Decimal("-12.50")), (4, None)]
+
+    assert encode(description, rows) == "id,amount\r\n1,1000\r\n2,0.0000001\r\n3,-12.50\r\n4,\r\n"
+    assert CsvEncoder([Column("n", 1700)], "postgres").encode([(Decimal("1E+3"),)]) == "1000\r\n"
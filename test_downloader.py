@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+import downloader
+from attachment_index import AttachmentIndex
+from rm_api import ReportFetchException
+
+
+class StubResponse(object):
+    status = 500
+    headers = {}
+
+
+def test_fetch_file_raises_failed_downloads_and_closes_the_index(tmp_path, monkeypatch):
+    indexes = []
+
+    def open_index(folder):
+        indexes.append(AttachmentIndex(folder))
+        return indexes[-1]
+
+    monkeypatch.setattr(downloader, "AttachmentIndex", open_index)
+
+    def fail(url, path, chunk_size, digest=None):
+        raise ReportFetchException(StubResponse())
+
+    monkeypatch.setattr(downloader, "stream_to_file", fail)
+
+    with pytest.raises(ReportFetchException):
+        downloader.fetch_file("https://example.com/a.pdf", "1/a.pdf", str(tmp_path), 1, "2024-01-01")
+    with pytest.raises(sqlite3.ProgrammingError):
+        indexes[0].missing([(1, "2024-01-01")])
+
+
+def test_fetch_file_returns_none_for_missing_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "stream_to_file", lambda url, path, chunk_size, digest=None: None)
+
+    assert downloader.fetch_file("https://example.com/a.pdf", "1/a.pdf", str(tmp_path), 1, "2024-01-01") is None
@@ -0,0 +1,126 @@
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pytest
+
+import greatcontrol
+from greatcontrol import ExportCheckpoint
+
+Column = namedtuple("Column", "name type_code")
+
+INT4 = 23
+
+
+class FakeTable(object):
+    """Just enough of a psycopg2 cursor (and connection) over one integer key column for keyset exports."""
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+        self.connection = self
+        self.description = [Column("id", INT4)]
+        self.rows = iter(())
+
+    def cursor(self, name=None):
+        return FakeTable(self.ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def mogrify(self, query, params):
+        return (query % tuple(f"'{param}'" for param in params)).encode()
+
+    def execute(self, query, params=None):
+        lower = re.search(r"id > '(\d+)'", query)
+        upper = re.search(r"id <= '(\d+)'", query)
+        ids = [i for i in self.ids if (not lower or i > int(lower[1])) and (not upper or i <= int(upper[1]))]
+        if "OFFSET" in query:
+            ids = [str(i) for i in ids[params[0]:params[0] + 1]]
+        self.rows = iter([(i,) for i in ids])
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def __iter__(self):
+        return self.rows
+
+
+def test_resume_after_crash_mid_table_neither_repeats_nor_skips_shards(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    uploaded = {}
+    crash_on_shard = [3]
+
+    def upload(generated_files, schema_name, output_folder, overwrite=False):
+        for file_name in generated_files:
+            if len(uploaded) + 1 == crash_on_shard[0]:
+                raise KeyboardInterrupt()
+            with open(file_name) as f:
+                uploaded[file_name] = f.read()
+        return True
+
+    monkeypatch.setattr(greatcontrol, "_upload_generated_files", upload)
+    export_args = dict(max_rows_per_shard=2, itersize=10, engine="python", sink=None, where=None, file_prefix=None,
+                       output_format="csv")
+    path = str(tmp_path / "s.checkpoint.json")
+
+    checkpoint = ExportCheckpoint("s", path=path)
+    checkpoint.start_table("t", key="id")
+    with pytest.raises(KeyboardInterrupt):
+        greatcontrol._export_table_in_key_ranges(FakeTable(range(1, 8)), "s", "t", "s", "id", 1000, checkpoint, [],
+                                                 export_args)
+
+    crash_on_shard[0] = None
+    resumed = ExportCheckpoint("s", resume=True, path=path)
+    committed = resumed.table("t")["shards"]
+    assert [shard["last_key"] for shard in committed] == ["2", "4"]
+    generated_files = greatcontrol._export_table_in_key_ranges(FakeTable(range(1, 8)), "s", "t", "s", "id", 1000,
+                                                               resumed, committed, export_args)
+
+    assert generated_files == ["t_shard_1.csv", "t_shard_2.csv", "t_shard_3.csv", "t_shard_4.csv"]
+    assert uploaded == {
+        "t_shard_1.csv": "id\n1\n2\n",
+        "t_shard_2.csv": "id\n3\n4\n",
+        "t_shard_3.csv": "id\n5\n6\n",
+        "t_shard_4.csv": "id\n7\n",
+    }
+    assert [shard["rows"] for shard in resumed.table("t")["shards"]] == [2, 2, 2, 1]
+
+
+@pytest.mark.parametrize("failing_table, kept", [(None, False), ("b", True)])
+def test_checkpoint_is_removed_only_after_every_table_is_exported(tmp_path, monkeypatch, failing_table, kept):
+    monkeypatch.chdir(tmp_path)
+
+    class Cursor(object):
+        connection = None
+
+        def execute(self, query):
+            pass
+
+        def fetchall(self):
+            return [("a", 1), ("b", 2)]
+
+        def rollback(self):
+            pass
+
+    Cursor.connection = Cursor()
+
+    @contextmanager
+    def get_cursor(**kwargs):
+        yield Cursor()
+
+    def export(cursor, schema_name, table_name, output_folder, checkpoint=None, **kwargs):
+        if table_name == failing_table:
+            raise RuntimeError("export failed")
+        checkpoint.finish_table(table_name)
+
+    monkeypatch.setattr(greatcontrol, "get_cursor", get_cursor)
+    monkeypatch.setattr(greatcontrol, "ensure_bucket_exists", lambda bucket: None)
+    monkeypatch.setattr(greatcontrol, "load_s3_key_index", lambda bucket, folder: None)
+    monkeypatch.setattr(greatcontrol, "_timed_export_table", export)
+
+    greatcontrol.postgres_to_csv("s", checkpoint=True)
+
+    assert (tmp_path / "s.checkpoint.json").exists() == kept
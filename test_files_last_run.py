@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import files
+
+
+def test_last_runs_are_kept_per_entity_type(tmp_path, monkeypatch):
+    monkeypatch.setattr(files, "LAST_RUN_PATH", str(tmp_path / "last_run"))
+    assert files.read_last_runs() == {}
+
+    files.write_last_run(["Deposit"], datetime(2024, 1, 1))
+    files.write_last_run(["Check", "Bill"], datetime(2024, 2, 1))
+    files.write_last_run(["Deposit"], datetime(2024, 3, 1))
+
+    assert files.read_last_runs() == {"Bill": datetime(2024, 2, 1), "Check": datetime(2024, 2, 1),
+                                      "Deposit": datetime(2024, 3, 1)}
+
+
+def test_a_last_run_not_recorded_per_entity_type_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / "last_run"
+    path.write_text("2024-01-01T00:00:00")
+    monkeypatch.setattr(files, "LAST_RUN_PATH", str(path))
+
+    assert files.read_last_runs() == {}
@@ -0,0 +1,35 @@
+import io
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from parquet_writer import ParquetShardWriter
+
+MYSQL_LONG = 3
+MYSQL_NEWDECIMAL = 246
+
+
+def mysql_column(name, type_code, flags=0):
+    """A mysql.connector `cursor.description` entry, which leaves precision and scale out."""
+    return (name, type_code, None, None, None, None, True, flags, 33)
+
+
+class KeptOpen(io.BytesIO):
+    def close(self):
+        pass
+
+
+def test_mysql_decimals_are_written_with_their_precision_and_scale():
+    description = [mysql_column("id", MYSQL_LONG), mysql_column("amount", MYSQL_NEWDECIMAL),
+                   mysql_column("rate", MYSQL_NEWDECIMAL)]
+    f = KeptOpen()
+    writer = ParquetShardWriter(f, description, "mysql", decimals={"amount": (10, 2)})
+    writer.write_rows([(1, Decimal("12.50"), Decimal("0.125")), (2, None, None)])
+    writer.close()
+
+    table = pq.read_table(io.BytesIO(f.getvalue()))
+    # Without a precision from information_schema a decimal stays text.
+    assert table.schema.field("amount").type == pa.decimal128(10, 2)
+    assert table.schema.field("rate").type == pa.string()
+    assert table.to_pydict() == {"id": [1, 2], "amount": [Decimal("12.50"), None], "rate": ["0.125", None]}
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def run_in_thread(pipeline, timeout=5):
+    """Run `pipeline`, failing the test instead of hanging if it does not finish within `timeout` seconds."""
+    outcome = {}
+
+    def run():
+        try:
+            pipeline.run()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+    return outcome.get('error')
+
+
+def test_items_flow_through_every_stage():
+    collected = []
+    pipeline = Pipeline(range(100), queue_size=4)
+    pipeline.stage("double", lambda item, emit: (emit(item), emit(item)), workers=3)
+    pipeline.stage("collect", lambda item, emit: collected.append(item), workers=2)
+
+    assert run_in_thread(pipeline) is None
+    assert sorted(collected) == sorted(list(range(100)) * 2)
+    assert [(stage.items, stage.emitted) for stage in pipeline.stages] == [(100, 200), (200, 0)]
+
+
+def test_a_failing_stage_stops_the_pipeline_and_its_error_is_raised():
+    closed = threading.Event()
+    handled = []
+
+    def source():
+        try:
+            for i in range(100000):
+                yield i
+        finally:
+            closed.set()
+
+    def fail(item, emit):
+        if item == 10:
+            raise ValueError("bad item")
+        emit(item)
+
+    pipeline = Pipeline(source(), queue_size=2)
+    pipeline.stage("check", fail, workers=2)
+    pipeline.stage("collect", lambda item, emit: handled.append(item))
+
+    error = run_in_thread(pipeline)
+    assert isinstance(error, ValueError)
+    assert closed.is_set()
+    assert len(handled) < 100
+
+
+def test_a_failing_source_stops_the_pipeline_and_its_error_is_raised():
+    handled = []
+
+    def source():
+        yield 1
+        yield 2
+        raise RuntimeError("database gone")
+
+    pipeline = Pipeline(source())
+    pipeline.stage("collect", lambda item, emit: handled.append(item))
+
+    assert isinstance(run_in_thread(pipeline), RuntimeError)
+    assert set(handled) <= {1, 2}
+
+
+def test_a_slow_stage_holds_back_the_source():
+    produced = []
+    release = threading.Event()
+    collected = []
+
+    def source():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    def slow(item, emit):
+        release.wait()
+        collected.append(item)
+
+    pipeline = Pipeline(source(), queue_size=2)
+    pipeline.stage("pass", lambda item, emit: emit(item))
+    pipeline.stage("slow", slow)
+    runner = threading.Thread(target=pipeline.run, daemon=True)
+    runner.start()
+
+    time.sleep(0.3)
+    # One item held by each stage and the source, two in each queue.
+    assert len(produced) <= 7
+    release.set()
+    runner.join(5)
+    assert not runner.is_alive()
+    assert collected == list(range(1000))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_an_empty_source_finishes(workers):
+    pipeline = Pipeline([])
+    pipeline.stage("a", lambda item, emit: emit(item), workers=workers)
+    pipeline.stage("b", lambda item, emit: None, workers=workers)
+
+    assert run_in_thread(pipeline) is None
@@ -0,0 +1,55 @@
+import gzip
+
+import boto3
+import lz4.frame
+import pytest
+import zstandard
+from moto import mock_aws
+
+import greatcontrol
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="bucket")
+        monkeypatch.setattr(greatcontrol, "get_s3_client", lambda region=None: client)
+        yield client
+
+
+def keys(s3):
+    return sorted(obj['Key'] for obj in s3.list_objects_v2(Bucket="bucket").get('Contents', []))
+
+
+def test_removes_shards_the_new_export_did_not_write(s3):
+    for key in ["s/t_shard_1.csv", "s/t_shard_2.csv", "s/t_shard_3.csv", "s/t_shard_1.parquet",
+                "s/t_delta_20240101T000000Z_shard_1.csv", "s/t_other_shard_1.csv", "s/_manifest.json"]:
+        s3.put_object(Bucket="bucket", Key=key, Body=b"x")
+
+    greatcontrol.remove_stale_shards("bucket", "s", "t", {"s/t_shard_1.csv", "s/t_shard_2.csv"})
+
+    assert keys(s3) == ["s/_manifest.json", "s/t_other_shard_1.csv", "s/t_shard_1.csv", "s/t_shard_2.csv"]
+
+
+@pytest.mark.parametrize("compression, extension", [(None, ""), ("gzip", ".gz"), ("zstd:9", ".zst"), ("lz4", ".lz4")])
+def test_s3_sink_compresses_shards_with_the_export_codecs(s3, compression, extension):
+    sink = greatcontrol.S3Sink("bucket", "s", compression)
+    with sink.open("t_shard_1.csv") as f:
+        f.write(b"id,name\n" * 1000)
+
+    body = s3.get_object(Bucket="bucket", Key=f"s/t_shard_1.csv{extension}")['Body'].read()
+    if compression == "gzip":
+        body = gzip.decompress(body)
+    elif compression == "zstd:9":
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    elif compression == "lz4":
+        body = lz4.frame.decompress(body)
+    assert body == b"id,name\n" * 1000
+
+
+def test_s3_sink_rejects_codecs_that_only_compress_zip_entries(s3):
+    with pytest.raises(ValueError):
+        greatcontrol.S3Sink("bucket", "s", "deflate")
@@ -0,0 +1,68 @@
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+def test_urls_differing_only_in_parameter_order_share_an_entry(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60, max_bytes=1024)
+    cache.put("https://API.example.com/Checks?pagesize=500&filters=CheckID,in,(1,2)", b"body")
+
+    assert cache.get("https://api.example.com/Checks?filters=CheckID,in,(1,2)&pagesize=500").body == b"body"
+
+
+def test_responses_expire_after_the_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60, max_bytes=1024)
+    cache.put("https://api.example.com/Checks", b"body")
+
+    clock.now += 59
+    assert cache.get("https://api.example.com/Checks").fresh
+    clock.now += 2
+    assert cache.get("https://api.example.com/Checks") is None
+
+
+def test_stale_responses_with_validators_are_revalidated(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60, max_bytes=1024)
+    cache.put("https://api.example.com/Checks", b"body", etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+    clock.now += 61
+
+    stale = cache.get("https://api.example.com/Checks")
+    assert not stale.fresh
+    assert stale.body == b"body"
+    assert stale.validators() == {'If-None-Match': '"v1"', 'If-Modified-Since': "Mon, 01 Jan 2024 00:00:00 GMT"}
+
+    cache.revalidated("https://api.example.com/Checks")
+    assert cache.get("https://api.example.com/Checks").fresh
+
+
+def test_least_recently_used_responses_are_evicted_past_max_bytes(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, ttl=60, max_bytes=10)
+    cache.put("https://api.example.com/a", b"aaaa")
+    clock.now += 1
+    cache.put("https://api.example.com/b", b"bbbb")
+    clock.now += 1
+    cache.get("https://api.example.com/a")
+    clock.now += 1
+    cache.put("https://api.example.com/c", b"cccc")
+
+    # The cache is a file, so a second process sees the same entries.
+    reopened = ResponseCache(path, ttl=60, max_bytes=10)
+    assert reopened.get("https://api.example.com/a").body == b"aaaa"
+    assert reopened.get("https://api.example.com/b") is None
+    assert reopened.get("https://api.example.com/c").body == b"cccc"
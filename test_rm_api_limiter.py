@@ -0,0 +1,155 @@
+import threading
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import rm_api
+from rm_api import AdaptiveLimiter, ReportFetchException, TokenManager
+
+
+class StubResponse(object):
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+class StubSession(object):
+    """Answers `rm_api_request`'s resolve calls with the given statuses in turn, then with a body."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, url, headers=None):
+        self.requests.append(headers)
+        if self.responses:
+            raise ReportFetchException(self.responses.pop(0))
+        return b"[]"
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = AdaptiveLimiter(4, maximum=8, decrease_interval=60)
+    monkeypatch.setattr(rm_api, "api_limiter", limiter)
+    monkeypatch.setattr(rm_api, "token_manager", TokenManager("token"))
+    return limiter
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rm_api.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_limit_grows_by_about_one_slot_per_limit_of_successes():
+    limiter = AdaptiveLimiter(2, maximum=3)
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release()
+    assert int(limiter.limit) == 2
+
+    limiter.acquire()
+    limiter.release()
+    assert int(limiter.limit) == 3
+
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 3
+
+
+def test_failures_that_are_not_throttling_leave_the_limit_alone():
+    limiter = AdaptiveLimiter(4)
+    limiter.acquire()
+    limiter.release(healthy=False)
+
+    assert limiter.limit == 4
+
+
+def test_a_burst_of_429s_halves_the_limit_once():
+    limiter = AdaptiveLimiter(8, minimum=3, decrease_interval=60)
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(throttled=True)
+    assert limiter.limit == 4
+
+    limiter._decreased_at -= 60
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 3
+
+
+def test_acquire_blocks_at_the_limit_until_a_slot_is_released():
+    limiter = AdaptiveLimiter(2)
+    limiter.acquire()
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(1)
+    waiter.join()
+    assert limiter.in_flight == 2
+
+
+def test_retry_after_pauses_every_caller():
+    limiter = AdaptiveLimiter(4)
+    limiter.acquire()
+    limiter.release(throttled=True, retry_after=0.2)
+
+    started = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - started >= 0.19
+
+
+def test_retry_after_seconds_reads_both_header_forms():
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+
+    assert rm_api.retry_after_seconds(StubResponse(429, {'Retry-After': '7'})) == 7
+    assert 55 < rm_api.retry_after_seconds(StubResponse(429, {'Retry-After': in_a_minute})) <= 60
+    assert rm_api.retry_after_seconds(StubResponse(429, {'Retry-After': 'soon'})) is None
+    assert rm_api.retry_after_seconds(StubResponse(429)) is None
+
+
+def test_retry_delay_is_capped_jitter_but_never_shorter_than_retry_after(monkeypatch):
+    monkeypatch.setattr(rm_api.random, "uniform", lambda low, high: high)
+
+    assert rm_api.retry_delay(1) == rm_api.API_RETRY_BASE_DELAY * 2
+    assert rm_api.retry_delay(30) == rm_api.API_RETRY_MAX_DELAY
+    assert rm_api.retry_delay(0, retry_after=rm_api.API_RETRY_MAX_DELAY + 5) == rm_api.API_RETRY_MAX_DELAY + 5
+
+
+def test_throttled_requests_back_off_for_retry_after_and_shrink_the_limit(limiter, sleeps, monkeypatch):
+    monkeypatch.setattr(rm_api.random, "uniform", lambda low, high: low)
+    session = StubSession(StubResponse(429, {'Retry-After': '0.1'}), StubResponse(503))
+
+    assert rm_api.rm_api_request("https://api.example.com/Checks", resolve=session) == b"[]"
+    assert len(session.requests) == 3
+    assert sleeps == [0.1, 0]
+    # Both rejections came within one decrease interval, and the success afterwards grows the limit a little.
+    assert limiter.limit == 2.5
+    assert limiter.in_flight == 0
+
+
+def test_requests_give_up_after_the_last_retry(limiter, sleeps):
+    session = StubSession(*[StubResponse(500)] * (rm_api.API_RETRIES + 1))
+
+    with pytest.raises(ReportFetchException):
+        rm_api.rm_api_request("https://api.example.com/Checks", resolve=session)
+    assert len(sleeps) == rm_api.API_RETRIES
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_other_errors_are_not_retried(limiter, sleeps):
+    session = StubSession(StubResponse(404))
+
+    with pytest.raises(ReportFetchException):
+        rm_api.rm_api_request("https://api.example.com/Checks", resolve=session)
+    assert sleeps == []
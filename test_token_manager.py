@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+import rm_api
+from rm_api import TokenManager, TokenRefreshError
+
+
+class StubAuth(object):
+    """Stands in for `refresh_token`, answering with the given tokens in turn once `release` is set."""
+
+    def __init__(self, *tokens):
+        self.tokens = list(tokens)
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self, persist=True):
+        self.calls += 1
+        self.release.wait(5)
+        return self.tokens.pop(0)
+
+
+def call_concurrently(target, count=8):
+    outcomes = [None] * count
+
+    def run(i):
+        try:
+            outcomes[i] = target()
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+@pytest.mark.parametrize("token", ["fresh", None])
+def test_callers_waiting_on_a_refresh_reuse_its_result(monkeypatch, token):
+    auth = StubAuth(token)
+    monkeypatch.setattr(rm_api, "refresh_token", auth)
+    manager = TokenManager()
+
+    threads, outcomes = call_concurrently(manager.get)
+    auth.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert auth.calls == 1
+    if token:
+        assert outcomes == ["fresh"] * 8
+    else:
+        assert all(isinstance(outcome, TokenRefreshError) for outcome in outcomes)
+
+
+def test_failures_are_kept_for_the_backoff_window(monkeypatch):
+    auth = StubAuth(None, "fresh")
+    auth.release.set()
+    monkeypatch.setattr(rm_api, "refresh_token", auth)
+    manager = TokenManager(failure_backoff=60)
+
+    for _ in range(3):
+        with pytest.raises(TokenRefreshError):
+            manager.get()
+    assert auth.calls == 1
+
+    manager._failed_until -= 60
+    assert manager.get() == "fresh"
+    assert auth.calls == 2
+
+
+def test_requests_raise_without_calling_the_api_when_authentication_fails(monkeypatch):
+    auth = StubAuth(None)
+    auth.release.set()
+    monkeypatch.setattr(rm_api, "refresh_token", auth)
+    monkeypatch.setattr(rm_api, "token_manager", TokenManager())
+    requests = []
+
+    threads, outcomes = call_concurrently(
+        lambda: rm_api.rm_api_request("https://api.example.com/Checks", resolve=lambda url, headers: requests.append(1)))
+    for thread in threads:
+        thread.join(5)
+
+    assert auth.calls == 1
+    assert requests == []
+    assert all(isinstance(outcome, TokenRefreshError) for outcome in outcomes)
@@ -0,0 +1,259 @@
+import os
+import json
+import logging
+import argparse
+from decimal import Decimal
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+import mysql.connector
+from dotenv import load_dotenv
+
+import greatcontrol
+from mysql_tables import DB_CONFIG, list_tables_by_size
+
+load_dotenv()
+
+WAREHOUSE_SCHEMA = os.getenv("WAREHOUSE_SCHEMA", "rent_manager")
+LOAD_BATCH_ROWS = int(os.getenv("LOAD_BATCH_ROWS", "100000"))
+COPY_READ_SIZE = 1024 * 1024
+# mysql.connector returns MySQL's zero dates ('0000-00-00') as None, which Postgres cannot take in a NOT NULL column;
+# there they are loaded as this date instead. In nullable columns they stay NULL.
+ZERO_DATE = os.getenv("ZERO_DATE", "0001-01-01")
+ZERO_DATE_TYPES = {'date', 'timestamp'}
+
+# MySQL DATA_TYPE -> Postgres type. decimal, unsigned integers and bit are handled in `postgres_type`.
+MYSQL_TO_POSTGRES = {
+    'tinyint': 'smallint',
+    'smallint': 'smallint',
+    'mediumint': 'integer',
+    'int': 'integer',
+    'integer': 'integer',
+    'bigint': 'bigint',
+    'float': 'real',
+    'double': 'double precision',
+    'real': 'double precision',
+    'date': 'date',
+    'datetime': 'timestamp',
+    'timestamp': 'timestamp',
+    'time': 'interval',
+    'year': 'smallint',
+    'json': 'jsonb',
+    'binary': 'bytea',
+    'varbinary': 'bytea',
+    'tinyblob': 'bytea',
+    'blob': 'bytea',
+    'mediumblob': 'bytea',
+    'longblob': 'bytea',
+}
+UNSIGNED_TO_POSTGRES = {
+    'tinyint': 'smallint',
+    'smallint': 'integer',
+    'mediumint': 'integer',
+    'int': 'bigint',
+    'integer': 'bigint',
+    'bigint': 'numeric(20)',
+}
+
+
+def postgres_type(data_type, column_type, precision, scale):
+    """Postgres column type for a MySQL column from information_schema.COLUMNS. Anything unmapped becomes text."""
+    if 'unsigned' in column_type and data_type in UNSIGNED_TO_POSTGRES:
+        return UNSIGNED_TO_POSTGRES[data_type]
+    elif data_type == 'decimal':
+        return f"numeric({precision},{scale})"
+    elif data_type == 'bit':
+        return 'boolean' if column_type == 'bit(1)' else 'bigint'
+    return MYSQL_TO_POSTGRES.get(data_type, 'text')
+
+
+def mysql_columns(cursor, table_name):
+    """Return [(name, postgres type, nullable, is primary key)] for a table of the current MySQL database."""
+    cursor.execute(
+        "SELECT COLUMN_NAME, DATA_TYPE, COLUMN_TYPE, NUMERIC_PRECISION, NUMERIC_SCALE, IS_NULLABLE, COLUMN_KEY "
+        "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+        "ORDER BY ORDINAL_POSITION",
+        (table_name,)
+    )
+    return [(name, postgres_type(data_type.lower(), column_type.lower(), precision, scale),
+             nullable == 'YES', key == 'PRI')
+            for name, data_type, column_type, precision, scale, nullable, key in cursor.fetchall()]
+
+
+def _identifier(name):
+    return '"' + name.lower().replace('"', '""') + '"'
+
+
+def _copy_value(value, pg_type):
+    if value is None:
+        return "\\N"
+    elif isinstance(value, str):
+        text = value
+    elif pg_type == 'bytea':
+        return "\\\\x" + bytes(value).hex()
+    elif pg_type == 'boolean':
+        return 't' if value else 'f'
+    elif isinstance(value, (bytes, bytearray)):
+        text = value.decode('utf-8', errors='replace')
+    elif isinstance(value, datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, (date, time, Decimal)):
+        return str(value)
+    elif isinstance(value, timedelta):
+        return f"{value.total_seconds()} seconds"
+    elif isinstance(value, (set, frozenset)):
+        text = ','.join(sorted(value))
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value)
+    else:
+        return str(value)
+    # Postgres text cannot hold NUL; backslash, tab and newlines have to be escaped in COPY's text format.
+    return (text.replace('\x00', '').replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_nulls(columns):
+    """What each column's None is written as: ZERO_DATE in NOT NULL date columns, where it stands for a zero date."""
+    return [ZERO_DATE if pg_type in ZERO_DATE_TYPES and not nullable else "\\N" for _, pg_type, nullable, _ in columns]
+
+
+class CopyReader(object):
+    """A file-like view of DB-API rows in Postgres COPY text format, for `cursor.copy_expert`."""
+
+    def __init__(self, rows, pg_types, nulls=None):
+        self.rows = rows
+        self.pg_types = pg_types
+        # What None is written as, per column.
+        self.nulls = nulls or ["\\N"] * len(pg_types)
+        self.row_count = 0
+        self._buffer = b""
+
+    def read(self, size=COPY_READ_SIZE):
+        size = size if size and size > 0 else COPY_READ_SIZE
+        lines = []
+        length = len(self._buffer)
+        for row in self.rows:
+            line = ('\t'.join(n if v is None else _copy_value(v, t) for v, t, n in zip(row, self.pg_types, self.nulls))
+                    + '\n').encode('utf-8')
+            lines.append(line)
+            length += len(line)
+            self.row_count += 1
+            if length >= size:
+                break
+        data = self._buffer + b"".join(lines)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _fetch_rows(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def load_table(mysql_cursor, pg_conn, schema_name, table_name, batch_size=10000, load_batch_rows=LOAD_BATCH_ROWS):
+    """Copy one MySQL table into `schema_name` on the warehouse, replacing the table if it already exists.
+
+    Rows are streamed from the MySQL cursor into `COPY ... FROM STDIN` on a staging table, committing every
+    `load_batch_rows` rows, and the staging table is swapped in for the old one in a single transaction at the end,
+    so readers keep seeing the previous copy until the load is complete.
+    """
+    columns = mysql_columns(mysql_cursor, table_name)
+    target = _identifier(table_name)
+    staging = _identifier(f"{table_name}__staging")
+    column_list = ", ".join(_identifier(name) for name, _, _, _ in columns)
+    definition = ", ".join(f"{_identifier(name)} {pg_type}{'' if nullable else ' NOT NULL'}"
+                           for name, pg_type, nullable, _ in columns)
+    primary_key = ", ".join(_identifier(name) for name, _, _, is_key in columns if is_key)
+
+    cursor = pg_conn.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{staging}")
+        cursor.execute(f"CREATE TABLE {schema_name}.{staging} ({definition})")
+        pg_conn.commit()
+
+        mysql_cursor.execute(f"SELECT * FROM `{table_name}`")
+        rows = _fetch_rows(mysql_cursor, batch_size)
+        pg_types = [pg_type for _, pg_type, _, _ in columns]
+        nulls = _copy_nulls(columns)
+        total_rows = 0
+        while True:
+            reader = CopyReader(islice(rows, load_batch_rows), pg_types, nulls)
+            cursor.copy_expert(f"COPY {schema_name}.{staging} ({column_list}) FROM STDIN", reader)
+            pg_conn.commit()
+            total_rows += reader.row_count
+            if reader.row_count < load_batch_rows:
+                break
+            logging.info(f"Loaded {total_rows} rows of {table_name}...")
+
+        staging_key = _identifier(f"{table_name}__staging_pkey")
+        if primary_key:
+            cursor.execute(f"ALTER TABLE {schema_name}.{staging} ADD CONSTRAINT {staging_key} "
+                           f"PRIMARY KEY ({primary_key})")
+        cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{target}")
+        cursor.execute(f"ALTER TABLE {schema_name}.{staging} RENAME TO {target}")
+        if primary_key:
+            cursor.execute(f"ALTER TABLE {schema_name}.{target} RENAME CONSTRAINT {staging_key} "
+                           f"TO {_identifier(f'{table_name}_pkey')}")
+        cursor.execute(f"ANALYZE {schema_name}.{target}")
+        pg_conn.commit()
+    except BaseException:
+        pg_conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    logging.info(f"Table {table_name} loaded into {schema_name} ({total_rows} rows).")
+    return total_rows
+
+
+def mysql_to_warehouse(schema_name=WAREHOUSE_SCHEMA, tables=None, batch_size=10000, load_batch_rows=LOAD_BATCH_ROWS,
+                       db_config=None):
+    """Load every table (or `tables`) of the Rent Manager database into `schema_name` on the warehouse.
+
+    All tables are read inside one consistent-snapshot transaction, so the warehouse receives a single point-in-time
+    copy of Rent Manager without any intermediate CSV files.
+    """
+    mydb = mysql.connector.connect(**(db_config or DB_CONFIG))
+    try:
+        mydb.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = mydb.cursor()
+        tables = tables or list_tables_by_size(cursor)
+        cursor.close()
+        logging.info(f"Total tables to load: {len(tables)}")
+
+        failed = []
+        with greatcontrol.get_conn(database=greatcontrol.database, user=greatcontrol.user,
+                                   password=greatcontrol.password, host=greatcontrol.host) as pg_conn:
+            with pg_conn.cursor() as pg_cursor:
+                pg_cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
+            pg_conn.commit()
+
+            cursor = mydb.cursor(buffered=False)
+            for i, table_name in enumerate(tables):
+                try:
+                    load_table(cursor, pg_conn, schema_name, table_name, batch_size, load_batch_rows)
+                    logging.info(f"Progress: {i + 1}/{len(tables)} tables loaded.")
+                except Exception as e:
+                    logging.error(f"Failed to load table {table_name}. Error: {e}")
+                    failed.append(table_name)
+                    if mydb.unread_result:
+                        mydb.consume_results()
+            cursor.close()
+        mydb.commit()
+    finally:
+        mydb.close()
+
+    logging.info(f"Warehouse load finished, {len(tables) - len(failed)}/{len(tables)} tables loaded.")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Rent Manager MySQL database into the Postgres warehouse.")
+    parser.add_argument("schema", nargs="?", default=WAREHOUSE_SCHEMA)
+    parser.add_argument("tables", nargs="*", help="only load these tables")
+    args = parser.parse_args()
+
+    mysql_to_warehouse(args.schema, args.tables)